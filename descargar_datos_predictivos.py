@@ -1,19 +1,70 @@
 #!/usr/bin/env python3
 import argparse
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
 import sys
 import csv
+import hashlib
+import json
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache, reduce
+from google.api_core import exceptions as google_exceptions
+from google.api_core.retry import Retry, if_exception_type
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import (
+    BatchRunReportsRequest,
     DateRange,
     Dimension,
     Metric,
     RunReportRequest,
+    RunReportResponse,
 )
 from google.oauth2 import service_account
 
+SCOPES_ANALYTICS = ["https://www.googleapis.com/auth/analytics.readonly"]
+
+# Clientes ya autenticados por huella de credenciales, reutilizados durante la vida del proceso
+MAX_CLIENTES_CACHE = 32
+_clientes_cache = OrderedDict()
+_clientes_cache_lock = threading.Lock()
+
+# Máximo de filas por página que admite la API de datos de GA4 (v1beta)
+MAX_FILAS_POR_PAGINA = 250000
+
+# La API de GA4 admite como máximo 5 informes por llamada a batchRunReports
+MAX_INFORMES_POR_LOTE = 5
+
+# Peticiones batchRunReports simultáneas durante una descarga (son independientes y limitadas por latencia)
+MAX_PETICIONES_PARALELAS = 8
+
+# Máximo de dimensiones que la API de GA4 admite en un informe
+MAX_DIMENSIONES_INFORME = 9
+
+# Dimensiones que se reconstruyen tras la descarga cuando no caben en MAX_DIMENSIONES_INFORME,
+# en orden de preferencia: dayOfWeek se calcula de date (exacto) y sessionDefaultChannelGrouping
+# se aproxima con la agrupación mayoritaria de cada par sessionSource/sessionMedium
+DIMENSIONES_DERIVADAS = ('dayOfWeek', 'sessionDefaultChannelGrouping')
+
+# Valores que GA4 devuelve cuando una dimensión no tiene dato
+VALORES_SIN_DATO = ['unknown', 'null', '(none)', '(not set)', '']
+
+# Reintentos con espera exponencial (2s, 4s, ... hasta 64s, con jitter) cuando GA4
+# responde con límite de cuota (HTTP 429 / RESOURCE_EXHAUSTED) o no está disponible
+REINTENTO_CUOTA = Retry(
+    predicate=if_exception_type(google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable),
+    initial=2.0,
+    maximum=64.0,
+    multiplier=2.0,
+    timeout=600.0,
+)
+
 def initialize_analytics_client(key_file_location):
     """Inicializa el cliente de Analytics Data.
 
@@ -26,14 +77,13 @@ def initialize_analytics_client(key_file_location):
     try:
         print(f"Intentando autenticar con credenciales de: {key_file_location}")
         
-        # Usar credenciales de cuenta de servicio
-        credentials = service_account.Credentials.from_service_account_file(
-            key_file_location,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"]
-        )
+        # El JSON se lee y analiza una sola vez mientras el archivo no cambie
+        ruta = os.path.abspath(key_file_location)
+        estado = os.stat(ruta)
+        info = _leer_credenciales(ruta, estado.st_mtime_ns, estado.st_size)
         
-        # Construir el cliente de Analytics Data
-        client = BetaAnalyticsDataClient(credentials=credentials)
+        # Construir (o reutilizar) el cliente de Analytics Data
+        client = initialize_analytics_client_from_info(info)
         print("✓ Autenticación exitosa con Google Analytics Data API")
         
         return client
@@ -41,84 +91,325 @@ def initialize_analytics_client(key_file_location):
         print(f"Error durante la autenticación: {str(e)}")
         sys.exit(1)
 
-def descargar_datos_paginados(client, property_id, start_date, end_date, dimensiones, metricas):
+@lru_cache(maxsize=MAX_CLIENTES_CACHE)
+def _leer_credenciales(ruta, mtime_ns, tamano):
+    """Lee el JSON de credenciales; la fecha de modificación y el tamaño forman parte de la clave de caché"""
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def initialize_analytics_client_from_info(info):
+    """Inicializa el cliente de Analytics Data a partir de credenciales ya cargadas en memoria.
+
+    Pensado para procesos que ya tienen el JSON de la cuenta de servicio (por ejemplo,
+    decodificado desde base64) y no necesitan escribirlo en un archivo temporal.
+    A diferencia de initialize_analytics_client, los errores se propagan al llamador.
+
+    Los clientes se guardan en caché por huella de las credenciales, de modo que las
+    descargas repetidas con la misma cuenta de servicio reutilizan el token OAuth y el
+    canal gRPC ya abiertos. Usar limpiar_cache_clientes() si cambian las credenciales.
+
+    Args:
+        info: diccionario con el contenido del JSON de credenciales
+
+    Returns:
+        Un cliente autorizado de Analytics Data.
+    """
+    huella = _huella_credenciales(info)
+    with _clientes_cache_lock:
+        client = _clientes_cache.get(huella)
+        if client is not None:
+            _clientes_cache.move_to_end(huella)
+            return client
+
+        credentials = service_account.Credentials.from_service_account_info(
+            info,
+            scopes=SCOPES_ANALYTICS
+        )
+        client = BetaAnalyticsDataClient(credentials=credentials)
+        _clientes_cache[huella] = client
+        if len(_clientes_cache) > MAX_CLIENTES_CACHE:
+            _clientes_cache.popitem(last=False)
+        return client
+
+def _huella_credenciales(info):
+    """Calcula una huella estable del JSON de credenciales para usarla como clave de caché"""
+    contenido = json.dumps(info, sort_keys=True).encode('utf-8')
+    return hashlib.blake2b(contenido, digest_size=16).hexdigest()
+
+def limpiar_cache_clientes():
+    """Descarta los clientes de Analytics Data guardados en caché"""
+    with _clientes_cache_lock:
+        _clientes_cache.clear()
+    _leer_credenciales.cache_clear()
+
+def _rango_cerrado(end_date):
+    """Indica si el rango termina antes de hoy; solo esos informes son estables y se guardan en caché"""
+    try:
+        return datetime.strptime(end_date, "%Y-%m-%d").date() < datetime.now().date()
+    except ValueError:
+        # Fechas relativas de GA4 ('today', 'yesterday', 'NdaysAgo')
+        return False
+
+def _ruta_cache_informe(directorio_cache, property_id, request):
+    """Ruta en caché de la respuesta a un informe, identificada por el SHA-256 de la solicitud serializada"""
+    clave = hashlib.sha256(property_id.encode('utf-8') + RunReportRequest.serialize(request)).hexdigest()
+    return os.path.join(directorio_cache, clave + '.pb')
+
+def _solicitar_lote(client, property_id, informes, end_date, directorio_cache=None):
     """
-    Descarga datos paginados para manejar el límite de 10,000 filas y el límite de 10 métricas por solicitud.
+    Envía un lote de hasta 5 informes, dados como pares (plantilla, offset), y devuelve sus respuestas.
+    Cada informe se crea copiando su plantilla (dimensiones, métricas, rango y límite ya construidos)
+    con el offset de su página.
+    Con directorio_cache, los informes ya descargados se leen de disco y solo se piden a la API los que faltan.
+    """
+    requests = [RunReportRequest(plantilla, offset=offset) for plantilla, offset in informes]
+
+    if not directorio_cache or not _rango_cerrado(end_date):
+        batch_request = BatchRunReportsRequest(property=property_id, requests=requests)
+        return client.batch_run_reports(batch_request, retry=REINTENTO_CUOTA).reports
+
+    reports = [None] * len(requests)
+    rutas = [_ruta_cache_informe(directorio_cache, property_id, request) for request in requests]
+    for i, ruta in enumerate(rutas):
+        if os.path.exists(ruta):
+            with open(ruta, 'rb') as f:
+                reports[i] = RunReportResponse.deserialize(f.read())
+
+    pendientes = [i for i, report in enumerate(reports) if report is None]
+    if pendientes:
+        batch_request = BatchRunReportsRequest(property=property_id, requests=[requests[i] for i in pendientes])
+        batch_response = client.batch_run_reports(batch_request, retry=REINTENTO_CUOTA)
+        for i, report in zip(pendientes, batch_response.reports):
+            reports[i] = report
+            ruta_temporal = rutas[i] + '.tmp'
+            with open(ruta_temporal, 'wb') as f:
+                f.write(RunReportResponse.serialize(report))
+            os.replace(ruta_temporal, rutas[i])
+    return reports
+
+def descargar_datos_paginados(client, property_id, start_date, end_date, dimensiones, metricas,
+                              page_size=MAX_FILAS_POR_PAGINA, directorio_cache=None):
+    """
+    Descarga datos paginados para manejar el límite de filas y el límite de 10 métricas por solicitud.
+    Se hace un informe por grupo de métricas, siempre con todas las dimensiones (máximo 9), y los
+    grupos se unen por las columnas de dimensiones para obtener una fila por combinación de dimensiones.
+    Los informes de cada página se envían juntos mediante batchRunReports (hasta 5 por llamada).
+    La primera página indica el total de filas (row_count) de cada grupo; solo se piden
+    páginas adicionales para los grupos que las necesitan, en paralelo, y se combinan
+    en el mismo orden que una descarga secuencial.
     
     Args:
         client: Cliente de Analytics Data.
         property_id: ID de la propiedad de GA4.
         start_date: Fecha de inicio en formato YYYY-MM-DD.
         end_date: Fecha de fin en formato YYYY-MM-DD.
-        dimensiones: Lista de dimensiones a incluir.
+        dimensiones: Lista de dimensiones a incluir (máximo 9, límite de la API).
         metricas: Lista de métricas a incluir.
+        page_size: Filas por página (por defecto el máximo de la API, 250,000).
+        directorio_cache: Carpeta donde guardar/reutilizar las respuestas de cada informe
+            (solo para rangos que terminan antes de hoy). Sin valor no se usa caché.
     
     Returns:
-        Lista de filas con los datos descargados.
+        DataFrame con los datos descargados (métricas como float32); vacío si no hay filas.
     """
     if not property_id.startswith("properties/"):
         property_id = f"properties/{property_id}"
+    if directorio_cache:
+        os.makedirs(directorio_cache, exist_ok=True)
 
-    all_rows = []
-    offset = 0
-    limit = 100000
-    max_dimensions = 9
+    limit = min(page_size, MAX_FILAS_POR_PAGINA)
+    max_dimensions = MAX_DIMENSIONES_INFORME
     max_metrics = 10
 
-    # Dividir dimensiones y métricas en grupos
-    dimension_groups = [dimensiones[i:i + max_dimensions] for i in range(0, len(dimensiones), max_dimensions)]
+    # Dividir solo las métricas en grupos: partir también las dimensiones daría filas con
+    # distintas combinaciones de dimensiones que no se pueden unir entre sí
+    if len(dimensiones) > max_dimensions:
+        raise ValueError(f"GA4 admite como máximo {max_dimensions} dimensiones por informe "
+                         f"y se indicaron {len(dimensiones)}")
     metric_groups = [metricas[i:i + max_metrics] for i in range(0, len(metricas), max_metrics)]
 
-    while True:
-        combined_rows = []
-        for dimension_group in dimension_groups:
-            for metric_group in metric_groups:
-                request = RunReportRequest(
-                    property=property_id,
-                    dimensions=[Dimension(name=d) for d in dimension_group],
-                    metrics=[Metric(name=m) for m in metric_group],
-                    date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-                    offset=offset,
-                    limit=limit,
-                )
+    grupos = [(dimensiones, metric_group) for metric_group in metric_groups]
+    frames_por_grupo = [[] for _ in grupos]
+
+    # Una solicitud plantilla por grupo: los mensajes Dimension/Metric/DateRange se
+    # construyen una sola vez y cada página solo cambia el offset
+    rango = DateRange(start_date=start_date, end_date=end_date)
+    plantillas = [
+        RunReportRequest(
+            dimensions=[Dimension(name=d) for d in dimension_group],
+            metrics=[Metric(name=m) for m in metric_group],
+            date_ranges=[rango],
+            limit=limit,
+        )
+        for dimension_group, metric_group in grupos
+    ]
+
+    def agrupar_en_lotes(informes):
+        """Agrupa pares (offset, índice de grupo) en lotes de hasta 5 informes por llamada"""
+        return [informes[i:i + MAX_INFORMES_POR_LOTE] for i in range(0, len(informes), MAX_INFORMES_POR_LOTE)]
 
-                response = client.run_report(request)
+    def solicitar(lote):
+        """
+        Descarga un lote y convierte cada informe a DataFrame en el propio hilo, de modo que las
+        respuestas protobuf se liberan en cuanto llegan. Devuelve pares (row_count, DataFrame o None).
+        """
+        reports = _solicitar_lote(client, property_id, [(plantillas[j], offset) for offset, j in lote],
+                                  end_date, directorio_cache)
+        return [
+            (response.row_count, _respuesta_a_dataframe(response, *grupos[j]) if response.rows else None)
+            for (_, j), response in zip(lote, reports)
+        ]
 
-                for row in response.rows:
-                    row_data = {}
-                    for i, dimension_value in enumerate(row.dimension_values):
-                        row_data[dimension_group[i]] = dimension_value.value
-                    for i, metric_value in enumerate(row.metric_values):
-                        row_data[metric_group[i]] = metric_value.value
-                    combined_rows.append(row_data)
+    with ThreadPoolExecutor(max_workers=MAX_PETICIONES_PARALELAS) as executor:
+        # Primera página de cada combinación: además de filas, informa de su total (row_count)
+        lotes = agrupar_en_lotes([(0, j) for j in range(len(grupos))])
+        respuestas = list(executor.map(solicitar, lotes))
 
-        all_rows.extend(combined_rows)
+        filas_por_grupo = {
+            j: row_count
+            for lote, paginas in zip(lotes, respuestas)
+            for (_, j), (row_count, _) in zip(lote, paginas)
+        }
+        # Solo las combinaciones que aún tienen filas generan páginas (ordenadas por offset)
+        pendientes = sorted(
+            (offset, j) for j, total in filas_por_grupo.items() for offset in range(limit, total, limit)
+        )
+        lotes_restantes = agrupar_en_lotes(pendientes)
+        respuestas.extend(executor.map(solicitar, lotes_restantes))
+        lotes.extend(lotes_restantes)
 
-        if len(combined_rows) < limit:
-            break
+    # Los informes se devuelven en el mismo orden que las solicitudes del lote
+    for lote, paginas in zip(lotes, respuestas):
+        for (_, j), (_, frame) in zip(lote, paginas):
+            if frame is not None:
+                frames_por_grupo[j].append(frame)
+    del respuestas
 
-        offset += limit
+    # Unir los grupos de métricas por las dimensiones (cada combinación de dimensiones es única)
+    tablas = [pd.concat(frames, ignore_index=True) for frames in frames_por_grupo if frames]
+    if not tablas:
+        return pd.DataFrame()
+    return reduce(lambda izquierda, derecha: izquierda.merge(derecha, on=dimensiones, how='outer', sort=False), tablas)
 
-    return all_rows
+def _respuesta_a_dataframe(response, dimension_group, metric_group):
+    """
+    Convierte un informe en DataFrame columna a columna (una lista por dimensión y un
+    array float32 por métrica) en lugar de crear un diccionario por fila.
+    Las métricas de GA4 son recuentos y tasas, así que float32 basta y ocupa la mitad.
+    Las dimensiones se conservan tal cual: son la clave de la unión entre grupos de métricas
+    y los valores sin dato se sustituyen después de unirlos (ver _limpiar_valores_sin_dato).
+    """
+    n_filas = len(response.rows)
+    columnas = {}
+    for i, nombre in enumerate(dimension_group):
+        columnas[nombre] = [row.dimension_values[i].value for row in response.rows]
+    for i, nombre in enumerate(metric_group):
+        columnas[nombre] = np.fromiter(
+            (float(row.metric_values[i].value) for row in response.rows), dtype=np.float32, count=n_filas
+        )
+    return pd.DataFrame(columnas)
 
-def guardar_datos_csv(data, output_file):
+def _dimensiones_a_derivar(dimensiones):
+    """
+    Devuelve las DIMENSIONES_DERIVADAS de dimensiones que hay que reconstruir tras la descarga:
+    solo las necesarias para no pasar de MAX_DIMENSIONES_INFORME, empezando por las exactas.
+    El resto se piden directamente a GA4.
+    """
+    exceso = len(dimensiones) - MAX_DIMENSIONES_INFORME
+    if exceso <= 0:
+        return []
+    return [d for d in DIMENSIONES_DERIVADAS if d in dimensiones][:exceso]
+
+def _añadir_dimensiones_derivadas(df, dimensiones, derivadas, client, property_id, start_date, end_date,
+                                  directorio_cache=None):
+    """
+    Añade a df las dimensiones de derivadas y deja las columnas de dimensiones en el orden
+    de dimensiones, de modo que el esquema coincide con el de las exportaciones (y los
+    modelos) anteriores.
+    - dayOfWeek se calcula de date con la numeración de GA4 ('0' = domingo ... '6' = sábado).
+    - sessionDefaultChannelGrouping es una aproximación: se obtiene de un informe adicional
+      más pequeño (sessionSource, sessionMedium, sessionDefaultChannelGrouping) y, para cada
+      par origen/medio, se toma la agrupación con más sesiones. Las sesiones de un mismo
+      par con otra agrupación (por ejemplo, según la campaña) reciben la mayoritaria.
+    """
+    if 'dayOfWeek' in derivadas and 'date' in df.columns:
+        fechas = pd.to_datetime(df['date'], format='%Y%m%d', errors='coerce')
+        dia_semana = (fechas.dt.dayofweek + 1) % 7
+        df['dayOfWeek'] = dia_semana.astype('Int64').astype(str).where(fechas.notna(), None)
+    if 'sessionDefaultChannelGrouping' in derivadas and {'sessionSource', 'sessionMedium'} <= set(df.columns):
+        print("⚠️ sessionDefaultChannelGrouping no cabe en el informe y se aproxima con la agrupación "
+              "mayoritaria de cada par sessionSource/sessionMedium")
+        claves = ['sessionSource', 'sessionMedium']
+        canales = descargar_datos_paginados(client, property_id, start_date, end_date,
+                                            claves + ['sessionDefaultChannelGrouping'], ['sessions'],
+                                            directorio_cache=directorio_cache)
+        if not canales.empty:
+            canales = (canales.sort_values('sessions', ascending=False, kind='stable')
+                              .drop_duplicates(claves)[claves + ['sessionDefaultChannelGrouping']])
+            df = df.merge(canales, on=claves, how='left', sort=False)
+    columnas_dimension = [col for col in dimensiones if col in df.columns]
+    return df[columnas_dimension + [col for col in df.columns if col not in set(columnas_dimension)]]
+
+def _limpiar_valores_sin_dato(df, dimensiones):
+    """
+    Sustituye por '0' los valores sin dato de las dimensiones y rellena con 0 los huecos de
+    métricas que deja la unión de grupos. Se aplica sobre los datos ya unidos: hacerlo antes
+    convertiría valores distintos ('(not set)', '') en la misma clave de unión.
+    """
+    columnas_dimension = [col for col in dimensiones if col in df.columns]
+    if columnas_dimension:
+        texto = df[columnas_dimension]
+        df[columnas_dimension] = texto.mask(texto.isna() | texto.isin(VALORES_SIN_DATO), '0')
+    return df.fillna(0)
+
+def guardar_datos_csv(data, output_file, fieldnames=None):
     """
     Guarda los datos combinados en un único archivo CSV.
+    Acepta un DataFrame (se escribe con el escritor CSV multihilo de PyArrow) o una lista
+    de diccionarios. Para la lista, fieldnames indica las columnas (por ejemplo
+    dimensiones + métricas); solo si no se indica se recorren las filas para deducirlas.
     """
+    if isinstance(data, pd.DataFrame):
+        if data.empty:
+            print("No hay datos para guardar.")
+            return
+        try:
+            tabla = pa.Table.from_pandas(data, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Columnas object con tipos mezclados: Arrow no puede inferir un tipo único
+            data.to_csv(output_file, index=False, encoding='utf-8')
+            return
+        pacsv.write_csv(tabla, output_file, write_options=pacsv.WriteOptions(include_header=True))
+        return
+
     if not data:
         print("No hay datos para guardar.")
         return
 
-    all_fieldnames = set()
-    for row in data:
-        all_fieldnames.update(row.keys())
-    all_fieldnames = sorted(all_fieldnames)
+    if fieldnames is None:
+        all_fieldnames = set()
+        for row in data:
+            all_fieldnames.update(row.keys())
+        fieldnames = sorted(all_fieldnames)
 
     with open(output_file, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=all_fieldnames)
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(data)
 
+def guardar_datos(df, output_file, formato='csv'):
+    """
+    Guarda el DataFrame en el formato indicado: 'csv', 'parquet' (Snappy, grupos de filas
+    grandes para limitar los metadatos) o 'feather' (Arrow IPC v2 con LZ4).
+    """
+    if formato == 'parquet':
+        df.to_parquet(output_file, engine='pyarrow', compression='snappy', index=False,
+                      row_group_size=1_000_000)
+    elif formato == 'feather':
+        feather.write_feather(df.reset_index(drop=True), output_file, compression='lz4', chunksize=65536)
+    else:
+        guardar_datos_csv(df, output_file)
+
 def main():
     parser = argparse.ArgumentParser(description='Descargar datos para modelos predictivos de GA4')
     parser.add_argument('--key-file', required=True, help='Ruta al archivo JSON de credenciales')
@@ -126,7 +417,10 @@ def main():
     parser.add_argument('--start-date', default='2020-01-01', help='Fecha de inicio (YYYY-MM-DD)')
     parser.add_argument('--end-date', default='2025-01-01', help='Fecha de fin (YYYY-MM-DD)')
     parser.add_argument('--modelo', default='conversiones', choices=['conversiones', 'engagement', 'todos'],help='Tipo de modelo predictivo a preparar')
-    parser.add_argument('--output', help='Nombre del archivo CSV de salida. Si no se especifica, se genera automáticamente.')
+    parser.add_argument('--output', help='Nombre del archivo de salida. Si no se especifica, se genera automáticamente.')
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet', 'feather'], help='Formato del archivo de salida')
+    parser.add_argument('--page-size', type=int, default=MAX_FILAS_POR_PAGINA, help='Filas por página en cada solicitud a GA4 (máximo 250000)')
+    parser.add_argument('--no-cache', action='store_true', help='No leer ni guardar respuestas de GA4 en la caché local')
 
     args = parser.parse_args()
     
@@ -137,7 +431,9 @@ def main():
         fecha_actual = datetime.now().strftime("%Y%m%d")
         args.output = f"ga4_datos_{args.modelo}_{fecha_actual}.csv"
 
-    args.output = os.path.join(carpeta_descargas, os.path.basename(args.output))
+    # La extensión del archivo de salida sigue al formato elegido
+    args.output = os.path.splitext(os.path.basename(args.output))[0] + f".{args.format}"
+    args.output = os.path.join(carpeta_descargas, args.output)
 
     client = initialize_analytics_client(args.key_file)
     
@@ -173,32 +469,37 @@ def main():
     dimensiones = [d for d in dimensiones if d]
 
     # Descargar datos solo para el rango de fechas indicado (sin dividir en periodos)
-    all_data = descargar_datos_paginados(client, args.property_id, args.start_date, args.end_date, dimensiones, metricas)
-    
-    df = pd.DataFrame(all_data)
+    # Caché de respuestas de GA4 junto a las descargas, para no repetir peticiones en rangos ya descargados
+    directorio_cache = None if args.no_cache else os.path.join(carpeta_descargas, '.cache')
+    # Las dimensiones que no caben en el informe se reconstruyen después de descargarlo
+    derivadas = _dimensiones_a_derivar(dimensiones)
+    dimensiones_informe = [d for d in dimensiones if d not in derivadas]
+    df = descargar_datos_paginados(client, args.property_id, args.start_date, args.end_date, dimensiones_informe, metricas,
+                                   page_size=args.page_size, directorio_cache=directorio_cache)
     
     if df.empty:
         print("❌ Error: No se descargaron datos. Verifica los parámetros de entrada.")
         sys.exit(1)
     
-    df.replace(['unknown', 'null', '(none)', '(not set)', ''], 0, inplace=True)
-    df.replace({pd.NA: 0, None: 0}, inplace=True)
-    df.fillna(0, inplace=True)
+    df = _añadir_dimensiones_derivadas(df, dimensiones, derivadas, client, args.property_id, args.start_date, args.end_date,
+                                       directorio_cache=directorio_cache)
+    
+    # Valores sin dato de las dimensiones y huecos de métricas, una vez unidos los grupos
+    df = _limpiar_valores_sin_dato(df, dimensiones)
     
     try:
-        guardar_datos_csv(df.to_dict(orient='records'), args.output)
+        guardar_datos(df, args.output, args.format)
         print(f"\nDatos guardados en: {args.output}")
 
         metricas_presentes = [m for m in metricas if m in df.columns]
         if metricas_presentes:
-            nombre_metricas = os.path.splitext(args.output)[0] + '_solo_metricas.csv'
-            df_metricas = df[metricas_presentes]
-            guardar_datos_csv(df_metricas.to_dict(orient='records'), nombre_metricas)
+            nombre_metricas = os.path.splitext(args.output)[0] + f'_solo_metricas.{args.format}'
+            guardar_datos(df[metricas_presentes], nombre_metricas, args.format)
             print(f"Archivo solo métricas guardado en: {nombre_metricas}")
         else:
             print("No se encontraron métricas presentes en los datos para crear el archivo solo métricas.")
     except Exception as e:
-        print(f"❌ Error al guardar los datos en CSV: {e}")
+        print(f"❌ Error al guardar los datos en {args.format.upper()}: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
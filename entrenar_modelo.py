@@ -3,41 +3,73 @@ import warnings
 import matplotlib
 matplotlib.use('Agg')
 import argparse
+import logging
 import os
 import numpy as np
 import pandas as pd
 import joblib
-import json
-from sklearn.model_selection import train_test_split
-from utils.datos import cargar_multiples_archivos
+from utils.datos import cargar_multiples_archivos, leer_columnas_csv
 from utils.evaluacion import evaluar_modelo, generar_informe
-from utils.incremental import imputar_valores_faltantes, entrenar_por_lotes
+from utils.incremental import entrenar_por_lotes, crear_pipeline_incremental
 from utils.pipelines import crear_pipeline_multioutput
+from utils.serializacion import a_json, guardar_json
 from utils.train_column import seleccionar_columnas_entrenamiento
 
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 warnings.filterwarnings('ignore', message='.*main thread.*')
 warnings.filterwarnings('ignore', message='.*main loop.*')
 
-def main():
+def reportar_progreso(porcentaje):
+    """
+    Emite una línea 'PROGRESS:<n>' en stdout (con flush inmediato) para que un proceso
+    padre que lea la salida línea a línea pueda actualizar el progreso del entrenamiento.
+    """
+    print(f"PROGRESS:{int(porcentaje)}", flush=True)
+
+def reportar_resultados(resultados):
+    """
+    Emite las métricas de evaluación como una única línea 'RESULT:<json>' en stdout, de modo
+    que el proceso padre las obtenga del mismo flujo que el progreso sin releer el JSON de disco.
+    """
+    print("RESULT:" + a_json(resultados), flush=True)
+
+def guardar_modelo(contenido, ruta_modelo):
+    """
+    Guarda el modelo en un archivo temporal y lo renombra sobre el destino. Así un proceso
+    que tenga el modelo cargado con mmap_mode (mapeado desde el mismo archivo) nunca lo ve
+    truncado, y los lectores no ven un archivo a medio escribir.
+    Se guarda sin compresión (compress=0) para que se pueda cargar con mmap_mode: joblib lo
+    ignora en archivos comprimidos. La API de flask-api-modelo-predictivo no carga estos
+    modelos de regresión, sino su propio clasificador (MODEL_PATH en app.py).
+    """
+    ruta_temporal = ruta_modelo + '.tmp'
+    joblib.dump(contenido, ruta_temporal, compress=0)
+    os.replace(ruta_temporal, ruta_modelo)
+
+def main(argv=None):
     """
     Función principal que orquesta el proceso de entrenamiento del modelo predictivo.
-    - Lee argumentos de línea de comandos.
+    - Lee argumentos de línea de comandos (o de argv, para invocarla desde un proceso
+      trabajador que ya tiene scikit-learn cargado, sin lanzar un intérprete nuevo).
     - Carga y prepara los datos.
     - Realiza la selección de columnas y filtrado de valores faltantes.
     - Divide los datos en conjuntos de entrenamiento y validación.
     - Entrena el modelo (de forma incremental o tradicional).
     - Evalúa el modelo y guarda los resultados y el modelo entrenado.
     """
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     parser = argparse.ArgumentParser(description='Entrenar modelo predictivo con datos históricos')
-    parser.add_argument('--archivos', nargs='+', help='Lista de archivos CSV con datos históricos', required=False)
+    parser.add_argument('--archivos', nargs='+', help='Lista de archivos CSV, Parquet o Feather con datos históricos', required=False)
     parser.add_argument('--objetivos', nargs='+', help='Lista de columnas objetivo (para múltiples objetivos)')
     parser.add_argument('--modelo-salida', default='modelo_ga.joblib', help='Ruta para guardar el modelo entrenado')
     parser.add_argument('--salida', default='resultados', help='Directorio para guardar resultados')
     parser.add_argument('--incremental', action='store_true', help='Entrenar el modelo de manera incremental')
     parser.add_argument('--batch-size', type=int, default=1000, help='Tamaño del lote para entrenamiento incremental')
     parser.add_argument('--epochs', type=int, default=10, help='Número de épocas para entrenamiento incremental')
-    args = parser.parse_args()
+    parser.add_argument('--dir-lotes', default=None, help='Directorio donde guardar los lotes del entrenamiento incremental como .npy para leerlos con memory-mapping')
+    parser.add_argument('--tamano-bloque', type=int, default=None, help='Leer los CSV por bloques de este número de filas para limitar la memoria')
+    parser.add_argument('--cache-dir', default=None, help='Directorio donde guardar los CSV leídos en Parquet para reutilizarlos en siguientes ejecuciones')
+    args = parser.parse_args(argv)
 
     if not args.archivos:
         parser.error("Debe proporcionar --archivos")
@@ -47,44 +79,64 @@ def main():
     # Definir la ruta completa para guardar el modelo dentro del directorio de salida
     ruta_modelo = os.path.join(args.salida, os.path.basename(args.modelo_salida))
 
+    # Comprueba los objetivos contra las cabeceras antes de cargar los archivos completos
+    if args.objetivos:
+        columnas_disponibles = set()
+        for archivo in args.archivos:
+            try:
+                columnas_disponibles.update(leer_columnas_csv(archivo))
+            except Exception:
+                continue
+        objetivos_faltantes = [col for col in args.objetivos if col not in columnas_disponibles]
+        if columnas_disponibles and objetivos_faltantes:
+            parser.error(f"Columnas objetivo no encontradas en los archivos: {', '.join(objetivos_faltantes)}")
+
     # Carga múltiples archivos CSV y los concatena en un solo DataFrame
-    datos = cargar_multiples_archivos(args.archivos)
+    datos = cargar_multiples_archivos(args.archivos, tamano_bloque=args.tamano_bloque, directorio_cache=args.cache_dir)
     columnas_objetivo = args.objetivos
+    reportar_progreso(10)
 
     # Selecciona las columnas de entrada y salida para el entrenamiento
     X, y, columnas_procesadas = seleccionar_columnas_entrenamiento(
         datos, columnas_objetivo, args
     )
+    # X ya llega en float32 desde seleccionar_columnas_entrenamiento, salvo las columnas enteras que
+    # no caben sin pérdida en float32 (fechas YYYYMMDD, identificadores), que se mantienen en float64
 
     print("\nVerificando valores faltantes en los objetivos (y)...")
-    if np.any(pd.isnull(y)):
+    # Una única pasada sobre y: máscara de filas con algún objetivo NaN
+    valores_y = np.asarray(y, dtype=float)
+    filas_con_nan = np.isnan(valores_y.reshape(len(valores_y), -1)).any(axis=1)
+    if filas_con_nan.any():
         print(f"⚠️ Se encontraron valores faltantes en los objetivos. Filtrando filas...")
-        mask = ~np.isnan(y).any(axis=1)
+        mask = ~filas_con_nan
         X = X[mask]
         y = y[mask]
         print(f"Dimensiones después de filtrar: X: {X.shape}, y: {y.shape}")
 
-    # Divide los datos en conjuntos de entrenamiento y validación
-    X_train, X_temp, y_train, y_temp = train_test_split(X, y, test_size=0.3, random_state=42)
-    X_val, _, y_val, _ = train_test_split(X_temp, y_temp, test_size=0.5, random_state=42)
+    # Divide los datos en entrenamiento (70%), validación (15%) y prueba (15%) con una
+    # única permutación; los tamaños coinciden con los de dos train_test_split encadenados
+    n_muestras = len(X)
+    n_temp = int(np.ceil(0.3 * n_muestras))
+    n_train = n_muestras - n_temp
+    indices = np.random.default_rng(42).permutation(n_muestras)
+    indices_train, indices_val = indices[:n_train], indices[n_train:n_train + n_temp // 2]
+    X_train, y_train = X.iloc[indices_train], y.iloc[indices_train]
+    X_val, y_val = X.iloc[indices_val], y.iloc[indices_val]
 
     print(f"\nConjunto de entrenamiento: {X_train.shape[0]} muestras")
     print(f"Conjunto de validación: {X_val.shape[0]} muestras")
+    reportar_progreso(20)
 
     if args.incremental:
         print("\nEntrenando modelo de manera incremental...")
         if os.path.exists(ruta_modelo):
             print(f"\nCargando modelo existente desde {ruta_modelo}...")
+            # Sin mmap_mode: el modelo se va a seguir entrenando y el ajuste escribe en sus arrays
             modelo_dict = joblib.load(ruta_modelo)
+            # Si el modelo predice otro número de objetivos, entrenar_por_lotes lo sustituye por uno nuevo
             modelo = modelo_dict['modelo']
             
-            # Verifica si el modelo existente es compatible con los nuevos objetivos
-            if hasattr(modelo, 'n_outputs_') and modelo.n_outputs_ != y.shape[1]:
-                print(f"\n❌ Error: El modelo existente fue entrenado para predecir {modelo.n_outputs_} objetivos, "
-                      f"pero los datos actuales tienen {y.shape[1]} objetivos.")
-                print("Re-entrenando modelo desde cero con los nuevos objetivos...")
-                modelo = crear_pipeline_multioutput()
-            
             columnas_modelo = modelo_dict.get('columnas', None)
             if columnas_modelo and set(columnas_modelo) != set(columnas_procesadas):
                 print("⚠️ Advertencia: Las características del modelo no coinciden con los datos actuales")
@@ -93,16 +145,18 @@ def main():
                 X = X[columnas_modelo]  # Usar solo las columnas del modelo original
         else:
             # Crea un nuevo pipeline para entrenamiento incremental
-            modelo = crear_pipeline_multioutput()
-        # Imputa valores faltantes en X antes de entrenar
-        X = imputar_valores_faltantes(X)
+            modelo = crear_pipeline_incremental(multiples_objetivos=y.ndim > 1 and y.shape[1] > 1)
+        # Los valores faltantes los imputa el propio pipeline (SimpleImputer)
         # Entrena el modelo por lotes (incremental)
         modelo = entrenar_por_lotes(modelo, X, y, 
                                     batch_size=args.batch_size, 
                                     n_epochs=args.epochs,
-                                    directorio_salida=args.salida)
+                                    directorio_salida=args.salida,
+                                    callback_progreso=lambda fraccion: reportar_progreso(20 + 70 * fraccion),
+                                    directorio_lotes=args.dir_lotes)
         print(f"\nGuardando modelo incremental en {ruta_modelo}...")
-        joblib.dump({'modelo': modelo, 'columnas': columnas_procesadas}, ruta_modelo)
+        guardar_modelo({'modelo': modelo, 'columnas': columnas_procesadas}, ruta_modelo)
+        reportar_progreso(100)
     else:
         if os.path.exists(ruta_modelo):
             print(f"\nCargando modelo existente desde {ruta_modelo}...")
@@ -119,12 +173,13 @@ def main():
             else:
                 modelo = modelo_dict['modelo']
         else:
-            print("\nCreando nuevo modelo GradientBoostingRegressor...")
+            print("\nCreando nuevo modelo HistGradientBoostingRegressor (MultiOutputRegressor)...")
             modelo = crear_pipeline_multioutput()
         
         print("\nEntrenando modelo...")
         # Entrena el modelo con el conjunto de entrenamiento
         modelo.fit(X_train, y_train)
+        reportar_progreso(70)
         
         print("\nEvaluando modelo...")
         # Verifica compatibilidad de dimensiones entre modelo y datos de validación
@@ -137,13 +192,15 @@ def main():
         # Evalúa el modelo y genera informe
         resultados = evaluar_modelo(modelo, X_train, y_train, X_val, y_val)
         generar_informe(modelo, X_val, y_val, directorio_salida=args.salida)
+        reportar_progreso(90)
         
         print(f"\nGuardando modelo en {ruta_modelo}...")
-        joblib.dump({'modelo': modelo, 'columnas': columnas_procesadas}, ruta_modelo)
+        guardar_modelo({'modelo': modelo, 'columnas': columnas_procesadas}, ruta_modelo)
         
         resultados_json = os.path.join(args.salida, 'resultados_modelo.json')
-        with open(resultados_json, 'w') as f:
-            json.dump(resultados, f, indent=2)
+        guardar_json(resultados, resultados_json)
+        reportar_resultados(resultados)
+        reportar_progreso(100)
         print("¡Entrenamiento finalizado con éxito!")
 
 if __name__ == "__main__":
@@ -5,7 +5,6 @@ Script para explorar las métricas y dimensiones disponibles en Google Analytics
 import argparse
 import pandas as pd
 import sys
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import (
     DateRange,
     Dimension,
@@ -13,34 +12,7 @@ from google.analytics.data_v1beta.types import (
     RunReportRequest,
     GetMetadataRequest
 )
-from google.oauth2 import service_account
-
-def initialize_analytics_client(key_file_location):
-    """Inicializa el cliente de Analytics Data.
-
-    Args:
-        key_file_location: ruta al archivo JSON de credenciales
-
-    Returns:
-        Un cliente autorizado de Analytics Data.
-    """
-    try:
-        print(f"Intentando autenticar con credenciales de: {key_file_location}")
-        
-        # Usar credenciales de cuenta de servicio
-        credentials = service_account.Credentials.from_service_account_file(
-            key_file_location,
-            scopes=["https://www.googleapis.com/auth/analytics.readonly"]
-        )
-        
-        # Construir el cliente de Analytics Data
-        client = BetaAnalyticsDataClient(credentials=credentials)
-        print("✓ Autenticación exitosa con Google Analytics Data API")
-        
-        return client
-    except Exception as e:
-        print(f"Error durante la autenticación: {str(e)}")
-        sys.exit(1)
+from descargar_datos_predictivos import initialize_analytics_client
 
 def obtener_metadatos(client, property_id):
     """
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# export_onnx.py - One-off export of the trained sklearn model to ONNX for faster inference
+# Requires skl2onnx (optional dependency, only needed to export; serving needs onnxruntime)
+import argparse
+import os
+
+import joblib
+from skl2onnx import convert_sklearn
+from skl2onnx.common.data_types import FloatTensorType
+
+def input_features(model, n_features=None):
+    """
+    Returns the number of input features of the ONNX graph: n_features when given,
+    otherwise the n_features_in_ the model was fitted with.
+    """
+    if n_features is not None:
+        return n_features
+    if not hasattr(model, "n_features_in_"):
+        raise ValueError("The model does not expose n_features_in_; pass --n-features explicitly")
+    return int(model.n_features_in_)
+
+def export_model(model_path, output_path, n_features=None):
+    """
+    Converts the joblib model at model_path to ONNX and writes it to output_path.
+    The input shape is taken from the fitted model unless n_features is given.
+    ZipMap is disabled so ONNX Runtime returns the probabilities as a plain array.
+    """
+    model = joblib.load(model_path)
+    n_features = input_features(model, n_features)
+    onnx_model = convert_sklearn(
+        model,
+        initial_types=[("input", FloatTensorType([None, n_features]))],
+        options={id(model): {"zipmap": False}},
+    )
+    with open(output_path, "wb") as f:
+        f.write(onnx_model.SerializeToString())
+    print(f"ONNX model saved to {output_path} ({n_features} input features)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the prediction model to ONNX")
+    parser.add_argument("--model", default="purchase_predictor_model_ensemble_20250414_181759.joblib",
+                        help="Path of the joblib model")
+    parser.add_argument("--output", help="Path of the ONNX file (default: same name with .onnx)")
+    parser.add_argument("--n-features", type=int, default=None,
+                        help="Number of input features (default: the model's n_features_in_)")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.splitext(args.model)[0] + ".onnx"
+    export_model(args.model, output_path, args.n_features)
+
+if __name__ == "__main__":
+    main()
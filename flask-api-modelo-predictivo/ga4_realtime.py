@@ -9,14 +9,49 @@ from google.analytics.data_v1beta.types import (
     Metric,
     Dimension,
     DateRange,
+    Filter,
+    FilterExpression,
 )
 from datetime import datetime, timedelta
+from functools import lru_cache
 import logging
+import threading
 
 # Configure GA4 credentials
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "inprofit-ia-casa.json"
 DEFAULT_PROPERTY_ID = "properties/271254856"  # Your GA4 property ID
 
+# Shared GA4 client: the Flask process is long-lived, so one gRPC channel is reused across requests
+_GA4_CLIENT = None
+_GA4_CLIENT_LOCK = threading.Lock()
+
+def _get_client():
+    """
+    Returns the shared BetaAnalyticsDataClient, creating it on first use.
+    The lock keeps threaded servers from opening several channels at startup.
+    """
+    global _GA4_CLIENT
+    if _GA4_CLIENT is None:
+        with _GA4_CLIENT_LOCK:
+            if _GA4_CLIENT is None:
+                _GA4_CLIENT = BetaAnalyticsDataClient()
+    return _GA4_CLIENT
+
+# Ratio features derived from the GA4 session metrics, in the column order of _session_ratios
+RATIO_FEATURES = ['pageviews_per_session', 'duration_per_session', 'events_per_session', 'checkout_rate']
+
+def _session_ratios(sessions, pageviews, duration, events, add_to_carts, checkouts, out):
+    """
+    Writes the four ratio features for every row into the preallocated (n_rows, 4)
+    array out. Denominators are floored at 1, as in training.
+    """
+    sessions_safe = np.maximum(sessions, 1.0)
+    np.divide(pageviews, sessions_safe, out=out[:, 0])
+    np.divide(duration, sessions_safe, out=out[:, 1])
+    np.divide(events, sessions_safe, out=out[:, 2])
+    np.divide(checkouts, np.maximum(add_to_carts, 1.0), out=out[:, 3])
+    return out
+
 def get_realtime_user_data(client_id, property_id=DEFAULT_PROPERTY_ID, minutes=30):
     """
     Fetches recent GA4 data for a specific client/user to make predictions.
@@ -30,8 +65,8 @@ def get_realtime_user_data(client_id, property_id=DEFAULT_PROPERTY_ID, minutes=3
         A pandas DataFrame with the user's metrics, ready for model prediction
     """
     try:
-        # Initialize the GA4 client
-        client = BetaAnalyticsDataClient()
+        # Reuse the shared GA4 client
+        client = _get_client()
         
         # Calculate the time range (last N minutes)
         end_date = datetime.now()
@@ -47,7 +82,7 @@ def get_realtime_user_data(client_id, property_id=DEFAULT_PROPERTY_ID, minutes=3
             dimensions=[
                 Dimension(name="sessionSourceMedium"),
                 Dimension(name="deviceCategory"),
-                Dimension(name="clientId"),  # Filter by this later
+                Dimension(name="clientId"),
             ],
             metrics=[
                 Metric(name="sessions"),
@@ -58,6 +93,16 @@ def get_realtime_user_data(client_id, property_id=DEFAULT_PROPERTY_ID, minutes=3
                 Metric(name="checkouts"),
             ],
             date_ranges=[DateRange(start_date=start_date_str, end_date=end_date_str)],
+            # Let GA4 keep only the target client's rows instead of filtering them here
+            dimension_filter=FilterExpression(
+                filter=Filter(
+                    field_name="clientId",
+                    string_filter=Filter.StringFilter(
+                        match_type=Filter.StringFilter.MatchType.EXACT,
+                        value=client_id,
+                    ),
+                )
+            ),
         )
         
         # Run the report
@@ -65,144 +110,186 @@ def get_realtime_user_data(client_id, property_id=DEFAULT_PROPERTY_ID, minutes=3
         
         # Check if we received data
         if response.row_count == 0:
-            logging.warning(f"No data found for client_id: {client_id}")
+            logging.warning("No data found for client_id: %s", client_id)
             return None
             
-        # Extract data and create DataFrame
-        rows = []
+        # Extract data column by column
+        rows = response.rows
         dim_headers = [header.name for header in response.dimension_headers]
         metric_headers = [header.name for header in response.metric_headers]
-        
-        for row in response.rows:
-            # Parse values into a dict
-            row_data = {}
-            for i, dim_value in enumerate(row.dimension_values):
-                row_data[dim_headers[i]] = dim_value.value
-            for i, metric_value in enumerate(row.metric_values):
-                row_data[metric_headers[i]] = float(metric_value.value)
-                
-            # Only keep data for our target client_id
-            if row_data.get('clientId') == client_id:
-                rows.append(row_data)
                 
         if not rows:
-            logging.warning(f"No data found for specific client_id: {client_id}")
+            logging.warning("No data found for specific client_id: %s", client_id)
             return None
-            
-        # Create DataFrame
-        df = pd.DataFrame(rows)
         
-        # Apply the same feature engineering as in training
-        if 'sessions' in df.columns and df['sessions'].sum() > 0:
-            df['pageviews_per_session'] = df['screenPageViews'] / df['sessions'].clip(lower=1)
-            df['duration_per_session'] = df['userEngagementDuration'] / df['sessions'].clip(lower=1)
-            df['events_per_session'] = df['eventCount'] / df['sessions'].clip(lower=1)
-        
-        if 'addToCarts' in df.columns and df['addToCarts'].sum() > 0:
-            df['checkout_rate'] = df['checkouts'] / df['addToCarts'].clip(lower=1)
-        else:
-            df['checkout_rate'] = 0
+        dim_cols = [[r.dimension_values[i].value for r in rows] for i in range(len(dim_headers))]
+        metric_cols = [
+            np.fromiter((r.metric_values[i].value for r in rows), dtype=np.float32, count=len(rows))
+            for i in range(len(metric_headers))
+        ]
             
-        # Ensure we have all required features (with defaults if missing)
-        for feature in ['pageviews_per_session', 'duration_per_session', 'events_per_session', 'checkout_rate']:
-            if feature not in df.columns:
-                df[feature] = 0
+        # Create DataFrame from the columns
+        df = pd.DataFrame({**dict(zip(dim_headers, dim_cols)), **dict(zip(metric_headers, metric_cols))})
+        
+        # Apply the same feature engineering as in training: all four ratios in one pass
+        # over the metric arrays (the request always asks for these six metrics)
+        ratios = _session_ratios(
+            df['sessions'].to_numpy(),
+            df['screenPageViews'].to_numpy(),
+            df['userEngagementDuration'].to_numpy(),
+            df['eventCount'].to_numpy(),
+            df['addToCarts'].to_numpy(),
+            df['checkouts'].to_numpy(),
+            np.empty((len(df), len(RATIO_FEATURES)), dtype=np.float32),
+        )
+        # Ratios stay at 0 when the user has no sessions / no add-to-carts at all
+        if df['sessions'].to_numpy().sum() <= 0:
+            ratios[:, :3] = 0
+        if df['addToCarts'].to_numpy().sum() <= 0:
+            ratios[:, 3] = 0
+        df[RATIO_FEATURES] = ratios
                 
         # Handle one-hot encoding for categorical variables
         df_encoded = pd.get_dummies(df, columns=['sessionSourceMedium', 'deviceCategory'], prefix=['sessionSourceMedium', 'deviceCategory'])
         
-        # Return the aggregated data (summing numeric values)
-        return df_encoded.sum().to_frame().T  # Single row with summed metrics
+        # Return the aggregated data (summing numeric values and one-hot flags);
+        # string columns such as clientId are not model features and are dropped
+        num_cols = df_encoded.select_dtypes(include=[np.number, 'bool']).columns
+        sums = df_encoded[num_cols].to_numpy(dtype=np.float32).sum(axis=0)
+        return pd.DataFrame(sums.reshape(1, -1), columns=num_cols)  # Single row with summed metrics
         
     except Exception as e:
         logging.error(f"Error fetching GA4 data: {e}")
         return None
 
+# The model was trained on exactly 14 features
+EXPECTED_FEATURES = 14
+
+# Domain-driven priority order used to pick the model features from training_columns
+IMPORTANT_NUMERICAL = [
+    'sessions',
+    'screenPageViews',
+    'userEngagementDuration',
+    'eventCount',
+    'addToCarts',
+    'checkouts',
+    'pageviews_per_session',
+    'duration_per_session',
+    'events_per_session',
+    'checkout_rate'
+]
+IMPORTANT_SOURCES = [
+    'sessionSourceMedium_google / organic',
+    'sessionSourceMedium_direct / none',
+    'sessionSourceMedium_admin / test'
+]
+IMPORTANT_DEVICES = [
+    'deviceCategory_desktop',
+    'deviceCategory_mobile'
+]
+
+@lru_cache(maxsize=8)
+def _selected_features(training_columns):
+    """
+    Pick the EXPECTED_FEATURES model features, in order, from a tuple of training
+    columns. Cached because the training columns only change when the model is reloaded.
+    """
+    available = set(training_columns)
+    selected = [col for col in IMPORTANT_NUMERICAL + IMPORTANT_SOURCES + IMPORTANT_DEVICES if col in available]
+    if len(selected) < EXPECTED_FEATURES:
+        chosen = set(selected)
+        remaining_cols = [col for col in training_columns if col not in chosen]
+        selected.extend(remaining_cols[:EXPECTED_FEATURES - len(selected)])
+    return tuple(selected[:EXPECTED_FEATURES])
+
+# Features selected for the columns of the loaded model, set once by configure()
+_CONFIGURED_COLUMNS = None
+_SELECTED_FEATURES = None
+
+def configure(training_columns):
+    """
+    Freeze the feature selection for the loaded model's training columns.
+    Called from load_model() so requests don't recompute it.
+    """
+    global _CONFIGURED_COLUMNS, _SELECTED_FEATURES
+    _SELECTED_FEATURES = _selected_features(tuple(training_columns))
+    _CONFIGURED_COLUMNS = training_columns
+    logging.info(f"Model features configured: {list(_SELECTED_FEATURES)}")
+
 def preprocess_for_prediction(user_data, training_columns):
     """
     Prepare user data for prediction by aligning columns with the training data
     
     Args:
-        user_data: DataFrame with user metrics
+        user_data: DataFrame or dict with user metrics
         training_columns: List of column names the model was trained with
         
     Returns:
-        DataFrame ready for model prediction
+        float32 ndarray (n_rows, 14) ready for model prediction, or None if user_data is None.
+        It carries no column names: column i is the i-th selected feature, in the order
+        the model was trained with (BatchPredictor re-attaches the model's feature names).
     """
     if user_data is None:
         return None
     
-    # Log información inicial sobre los datos
-    logging.info(f"Input features shape: {user_data.shape}, columns disponibles: {user_data.columns}")
-    
-    # Nuestro modelo necesita exactamente 14 características
-    EXPECTED_FEATURES = 14
-    
-    # Paso 1: Preparar todas las columnas posibles usando las columnas de entrenamiento
-    X_all_columns = pd.DataFrame(index=user_data.index)
-    for col in training_columns:
-        if col in user_data.columns:
-            X_all_columns[col] = user_data[col]
-        else:
-            X_all_columns[col] = 0
-    
-    # Definir las características más importantes basadas en conocimiento del dominio
-    # Características numéricas prioritarias
-    important_numerical = [
-        'sessions',
-        'screenPageViews',
-        'userEngagementDuration',
-        'eventCount',
-        'addToCarts',
-        'checkouts',
-        'pageviews_per_session',
-        'duration_per_session',
-        'events_per_session',
-        'checkout_rate'
-    ]
-    
-    # Filtrar solo las que están en las columnas de entrenamiento
-    important_numerical = [col for col in important_numerical if col in training_columns]
-    
-    # Categorías principales para sessionSourceMedium
-    important_sources = [
-        'sessionSourceMedium_google / organic',
-        'sessionSourceMedium_direct / none',
-        'sessionSourceMedium_admin / test'
-    ]
-    important_sources = [col for col in important_sources if col in training_columns]
-    
-    # Categorías principales para deviceCategory
-    important_devices = [
-        'deviceCategory_desktop',
-        'deviceCategory_mobile'
-    ]
-    important_devices = [col for col in important_devices if col in training_columns]
-    
-    # Combinar todas las características importantes
-    all_important = important_numerical + important_sources + important_devices
-    
-    # Seleccionar exactamente las 14 características más importantes
-    # Si tenemos menos de 14, añadir del resto de columnas
-    if len(all_important) < EXPECTED_FEATURES:
-        remaining_cols = [col for col in training_columns if col not in all_important]
-        all_important.extend(remaining_cols[:EXPECTED_FEATURES - len(all_important)])
-    
-    # Limitar a exactamente 14 características
-    selected_features = all_important[:EXPECTED_FEATURES]
-    
-    # Asegurarnos de que todas estas características existen en el DataFrame
-    for feature in selected_features:
-        if feature not in X_all_columns:
-            X_all_columns[feature] = 0
+    # Features are picked once per set of training columns, not on every request
+    if training_columns is _CONFIGURED_COLUMNS:
+        selected = _SELECTED_FEATURES
+    else:
+        selected = _selected_features(tuple(training_columns))
     
-    # Crear el DataFrame final con exactamente 14 características
-    X_processed = X_all_columns[selected_features]
+    # Fill the feature matrix by position; features missing from user_data stay at 0
+    if isinstance(user_data, pd.DataFrame):
+        logging.debug("Input features shape: %s, columns disponibles: %s", user_data.shape, user_data.columns)
+        X = np.zeros((len(user_data), len(selected)), dtype=np.float32)
+        for i, col in enumerate(selected):
+            if col in user_data.columns:
+                X[:, i] = user_data[col].to_numpy(dtype=np.float32)
+    else:
+        X = np.zeros((1, len(selected)), dtype=np.float32)
+        for i, col in enumerate(selected):
+            value = user_data.get(col)
+            if value is not None:
+                X[0, i] = value
     
     # Log para depuración
-    logging.info(f"Datos preprocesados con {X_processed.shape[1]} características: {X_processed.columns.tolist()}")
+    logging.debug("Datos preprocesados con %d características: %s", X.shape[1], selected)
     
-    return X_processed
+    return X
+
+# Fixed one-hot columns built from the website payload (limited set to avoid explosion)
+CATEGORICAL_FEATURES = [
+    'sessionSourceMedium_google / organic',
+    'sessionSourceMedium_direct / none',
+    'sessionSourceMedium_facebook / referral',
+    'sessionSourceMedium_admin / test',
+    'sessionSourceMedium_other / referral',
+    'deviceCategory_desktop',
+    'deviceCategory_mobile',
+    'deviceCategory_tablet'
+]
+KNOWN_DEVICES = {'desktop', 'mobile', 'tablet'}
+
+@lru_cache(maxsize=1024)
+def _active_categories(source_medium, device):
+    """
+    Returns the one-hot columns set to 1 for a (lowercased) source/medium and device.
+    Websites send a small set of distinct values, so each pair is classified only once.
+    """
+    active = []
+    if 'google' in source_medium and 'organic' in source_medium:
+        active.append('sessionSourceMedium_google / organic')
+    if 'direct' in source_medium and 'none' in source_medium:
+        active.append('sessionSourceMedium_direct / none')
+    if 'facebook' in source_medium:
+        active.append('sessionSourceMedium_facebook / referral')
+    if 'admin' in source_medium and 'test' in source_medium:
+        active.append('sessionSourceMedium_admin / test')
+    if not any(x in source_medium for x in ['google', 'direct', 'facebook', 'admin']):
+        active.append('sessionSourceMedium_other / referral')
+    if device in KNOWN_DEVICES:
+        active.append(f'deviceCategory_{device}')
+    return tuple(active)
 
 def get_user_metrics_from_website(user_data, training_columns=None):
     """
@@ -213,13 +300,11 @@ def get_user_metrics_from_website(user_data, training_columns=None):
         training_columns: Optional list of column names the model was trained with
         
     Returns:
-        DataFrame ready for feature engineering with limited features
+        float32 ndarray from preprocess_for_prediction when training_columns is given,
+        otherwise a one-row DataFrame with the limited set of website features
     """
     # Log the incoming data for debugging
-    logging.info(f"Website data received: {user_data}")
-    
-    # Convert to DataFrame
-    df = pd.DataFrame([user_data])
+    logging.debug("Website data received: %s", user_data)
     
     # ---- Create FIXED features instead of dynamic encoding ----
     # First extract the basic numeric features
@@ -246,32 +331,19 @@ def get_user_metrics_from_website(user_data, training_columns=None):
     source_medium = user_data.get('sessionSourceMedium', 'other / referral').lower()
     device = user_data.get('deviceCategory', 'desktop').lower()
     
-    # Create fixed categorical columns for common sources/mediums
-    categorical_features = {
-        'sessionSourceMedium_google / organic': 1.0 if 'google' in source_medium and 'organic' in source_medium else 0.0,
-        'sessionSourceMedium_direct / none': 1.0 if 'direct' in source_medium and 'none' in source_medium else 0.0,
-        'sessionSourceMedium_facebook / referral': 1.0 if 'facebook' in source_medium else 0.0,
-        'sessionSourceMedium_admin / test': 1.0 if 'admin' in source_medium and 'test' in source_medium else 0.0,
-        'sessionSourceMedium_other / referral': 1.0 if not any(x in source_medium for x in ['google', 'direct', 'facebook', 'admin']) else 0.0,
-        'deviceCategory_desktop': 1.0 if device == 'desktop' else 0.0,
-        'deviceCategory_mobile': 1.0 if device == 'mobile' else 0.0,
-        'deviceCategory_tablet': 1.0 if device == 'tablet' else 0.0
-    }
+    # Create fixed categorical columns for common sources/mediums and devices
+    categorical_features = dict.fromkeys(CATEGORICAL_FEATURES, 0.0)
+    for col in _active_categories(source_medium, device):
+        categorical_features[col] = 1.0
     
     # Combine all features (both numeric and categorical)
     all_features = {**numeric_features, **categorical_features}
     
-    # Create DataFrame with fixed set of features
-    df_fixed = pd.DataFrame([all_features])
-    
-    # Log for debugging
-    logging.info(f"Fixed features created: {len(df_fixed.columns)}, columns: {df_fixed.columns}")
-    
-    # If training columns are provided, use preprocess_for_prediction to ensure
-    # we return exactly the right number of features
-    if training_columns is not None:
-        df_processed = preprocess_for_prediction(df_fixed, training_columns)
-        logging.info(f"Features after preprocessing: {len(df_processed.columns)}, columns: {df_processed.columns}")
-        return df_processed
+    # Without training columns, return the fixed feature set as a DataFrame
+    if training_columns is None:
+        df_fixed = pd.DataFrame([all_features])
+        logging.debug("Fixed features created: %d, columns: %s", len(df_fixed.columns), df_fixed.columns)
+        return df_fixed
     
-    return df_fixed
+    # Fill the model's feature vector straight from the feature dict
+    return preprocess_for_prediction(all_features, training_columns)
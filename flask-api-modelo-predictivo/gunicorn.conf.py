@@ -0,0 +1,14 @@
+# gunicorn.conf.py - Production server settings for the prediction API
+# Usage: gunicorn wsgi:app   (or: gunicorn prediction_api:app)
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Several processes, each with a few threads, so predictions run in parallel
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+
+# Load the app (and the memory-mapped model) once in the master; workers share it copy-on-write
+preload_app = True
+
+timeout = 30
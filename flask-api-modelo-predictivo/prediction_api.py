@@ -2,33 +2,33 @@
 # prediction_api.py - API for real-time purchase prediction
 import os
 import joblib
+import json
 import logging
 import pandas as pd
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, request, make_response
 from flask_restful import Api, Resource
-from datetime import datetime
 from flask_cors import CORS, cross_origin
+from werkzeug.exceptions import HTTPException
 
 # Import GA4 real-time data functions
 from ga4_realtime import (
     get_realtime_user_data,
     preprocess_for_prediction,
-    get_user_metrics_from_website
+    get_user_metrics_from_website,
+    configure as configure_features
 )
+from serving import BatchPredictor, iso_now_cached, load_onnx_model
 
-# Configure logging - enhanced version
+# Configure logging: WARNING by default, full DEBUG output (console + file) with API_DEBUG=1
+API_DEBUG = bool(os.environ.get('API_DEBUG'))
+log_handlers = [logging.StreamHandler()]
+if API_DEBUG:
+    log_handlers.append(logging.FileHandler('prediction_api.log'))
 logging.basicConfig(
-    level=logging.DEBUG,  # Cambiar a DEBUG para más detalles
+    level=logging.DEBUG if API_DEBUG else logging.WARNING,
     format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('prediction_api.log')
-    ]
+    handlers=log_handlers
 )
-# Configuración detallada para CORS y Flask
-logging.getLogger('flask_cors').level = logging.DEBUG
-logging.getLogger('flask').level = logging.DEBUG
-logging.getLogger('werkzeug').level = logging.DEBUG
 
 # Log inicial para verificar que el registro está funcionando
 logging.info("=====================================")
@@ -37,12 +37,15 @@ logging.info("=====================================")
 
 # --- Configuration ---
 MODEL_PATH = "purchase_predictor_model_ensemble_20250414_181759.joblib"
+ONNX_MODEL_PATH = os.path.splitext(MODEL_PATH)[0] + ".onnx"  # Optional export made with export_onnx.py
 COLUMNS_PATH = "training_columns.joblib"
 OPTIMAL_THRESHOLD = 0.70  # The optimized threshold found during model training
+MAX_REQUEST_BYTES = 64 * 1024  # Larger request bodies are rejected with 413 (raised by request.get_data)
 # --- End Configuration ---
 
 # Initialize Flask app
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
 # Configuración CORS más permisiva para desarrollo
 cors = CORS(app,
@@ -83,16 +86,47 @@ def handle_options_website():
 
 api = Api(app)
 
+# orjson parses and serializes the prediction payloads much faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def parse_json_body():
+    """Parse the raw request body as JSON (regardless of Content-Type), reading it only once"""
+    body = request.get_data(cache=False)
+    if app.debug:
+        logging.debug("Request body: %d bytes", len(body))
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def json_response(payload, status=200):
+    """Build a JSON response directly, without going through flask-restful's marshalling"""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload)
+    return Response(body, status=status, mimetype='application/json')
+
 # Load model and training columns
 model = None
 training_columns = None
+# Scores concurrent requests together in micro-batches
+predictor = None
 
 def load_model():
     """Load the trained model and columns"""
-    global model, training_columns
+    global model, training_columns, predictor
     try:
-        model = joblib.load(MODEL_PATH)
+        # When MODEL_PATH is an uncompressed joblib dump (compress=0), its arrays are memory-mapped
+        # (paged in on demand and shared between workers instead of copied onto each heap);
+        # joblib ignores mmap_mode for compressed files and loads them fully into memory
+        model = joblib.load(MODEL_PATH, mmap_mode='r')
         training_columns = joblib.load(COLUMNS_PATH)
+        configure_features(training_columns)
+        # Score with ONNX Runtime when an exported model is available
+        predictor = BatchPredictor(load_onnx_model(ONNX_MODEL_PATH) or model)
         logging.info(f"Model loaded successfully from {MODEL_PATH}")
         return True
     except Exception as e:
@@ -104,163 +138,157 @@ class HealthCheck(Resource):
     def get(self):
         return {"status": "ok", "model_loaded": model is not None}
 
-class PredictFromGA4(Resource):
+@app.route('/predict/ga4', methods=['POST'])
+def predict_from_ga4():
     """API endpoint to predict purchase likelihood using GA4 data"""
-    def post(self):
-        if not model or not training_columns:
-            return {"error": "Model not loaded"}, 500
-            
-        # Get client_id from request
-        try:
-            data = request.get_json(force=True)
-            client_id = data.get("client_id")
-            minutes = data.get("minutes", 30)  # How far back to look
-            
-            if not client_id:
-                return {"error": "client_id is required"}, 400
-        except Exception as e:
-            logging.error(f"Error parsing request: {e}")
-            return {"error": "Invalid request format"}, 400
-            
-        # Get user data from GA4
-        user_data = get_realtime_user_data(client_id, minutes=minutes)
-        if user_data is None:
-            return {"error": "No data found for this user"}, 404
-            
-        # Prepare data for prediction
-        X = preprocess_for_prediction(user_data, training_columns)
-        if X is None:
-            return {"error": "Error preparing data for prediction"}, 500
-            
-        # Make prediction
-        try:
-            # Get probability
-            purchase_prob = model.predict_proba(X)[0, 1]
-            
-            # Apply optimal threshold
-            purchase_likely = purchase_prob >= OPTIMAL_THRESHOLD
-            
-            # Round probability for cleaner output
-            purchase_prob = round(float(purchase_prob), 4)
-            
-            # Prepare response
-            result = {
-                "client_id": client_id,
-                "purchase_probability": purchase_prob,
-                "purchase_likely": bool(purchase_likely),
-                "threshold_used": OPTIMAL_THRESHOLD,
-                "timestamp": datetime.now().isoformat(),
-                "features_used": len(training_columns)
-            }
-            
-            # Log prediction
-            logging.info(f"Prediction for {client_id}: prob={purchase_prob}, likely={purchase_likely}")
-            
-            return result, 200
-            
-        except Exception as e:
-            logging.error(f"Error making prediction: {e}")
-            return {"error": f"Prediction error: {str(e)}"}, 500
+    if not model or not training_columns:
+        return json_response({"error": "Model not loaded"}, 500)
+        
+    # Get client_id from request
+    try:
+        data = parse_json_body()
+        client_id = data.get("client_id")
+        minutes = data.get("minutes", 30)  # How far back to look
+        
+        if not client_id:
+            return json_response({"error": "client_id is required"}, 400)
+    except HTTPException:
+        # Let Flask answer errors raised while reading the body (413 when over MAX_REQUEST_BYTES)
+        raise
+    except Exception as e:
+        logging.error(f"Error parsing request: {e}")
+        return json_response({"error": "Invalid request format"}, 400)
+        
+    # Get user data from GA4
+    user_data = get_realtime_user_data(client_id, minutes=minutes)
+    if user_data is None:
+        return json_response({"error": "No data found for this user"}, 404)
+        
+    # Prepare data for prediction (float32 array in the model's feature order, no column names)
+    X = preprocess_for_prediction(user_data, training_columns)
+    if X is None:
+        return json_response({"error": "Error preparing data for prediction"}, 500)
+        
+    # Make prediction
+    try:
+        # Get probability (batched with concurrent requests)
+        purchase_prob = predictor.predict(X)[0]
+        
+        # Apply optimal threshold
+        purchase_likely = purchase_prob >= OPTIMAL_THRESHOLD
+        
+        # Round probability for cleaner output
+        purchase_prob = round(float(purchase_prob), 4)
+        
+        # Prepare response
+        result = {
+            "client_id": client_id,
+            "purchase_probability": purchase_prob,
+            "purchase_likely": bool(purchase_likely),
+            "threshold_used": OPTIMAL_THRESHOLD,
+            "timestamp": iso_now_cached(),
+            "features_used": len(training_columns)
+        }
+        
+        # Log prediction
+        logging.info("Prediction for %s: prob=%s, likely=%s", client_id, purchase_prob, purchase_likely)
+        
+        return json_response(result)
+        
+    except Exception as e:
+        logging.error(f"Error making prediction: {e}")
+        return json_response({"error": f"Prediction error: {str(e)}"}, 500)
 
-class PredictFromWebsite(Resource):
+@app.route('/predict/website', methods=['POST'])
+def predict_from_website():
     """API endpoint to predict purchase likelihood using data sent directly from website"""
-    def post(self):
-        # Log origin for debugging
-        origin = request.headers.get('Origin', 'No Origin header')
-        logging.info(f"Received request from: {origin}")
-        logging.info(f"Headers: {request.headers}")
+    # Log origin and headers for debugging
+    if app.debug:
+        logging.debug("Received request from: %s", request.headers.get('Origin', 'No Origin header'))
+        logging.debug("Headers: %s", request.headers)
+    
+    if not model or not training_columns:
+        return json_response({"status": "error", "error": "Model not loaded"}, 500)
         
-        if not model or not training_columns:
-            response = jsonify({"status": "error", "error": "Model not loaded"})
-            return response, 500
-            
-        # Get user data from request
-        try:
-            # Log the raw request data for debugging
-            raw_data = request.get_data()
-            logging.info(f"Request data: {raw_data}")
-            
-            user_data = request.get_json(force=True)
-            logging.info(f"Processed user data: {user_data}")
-            user_id = user_data.get("user_id", "unknown")
+    # Get user data from request
+    try:
+        user_data = parse_json_body()
+        if app.debug:
+            logging.debug("Processed user data: %s", user_data)
+        user_id = user_data.get("user_id", "unknown")
+        
+        # Remove the user_id from metrics
+        if "user_id" in user_data:
+            user_data_copy = user_data.copy()
+            del user_data_copy["user_id"]
+        else:
+            user_data_copy = user_data
             
-            # Remove the user_id from metrics
-            if "user_id" in user_data:
-                user_data_copy = user_data.copy()
-                del user_data_copy["user_id"]
+        # Check if we have the minimum required data
+        required_fields = ["sessionSourceMedium", "deviceCategory"]
+        for field in required_fields:
+            if field not in user_data_copy:
+                return json_response({"status": "error", "error": f"Missing required field: {field}"}, 400)
+                
+        # Ensure numeric fields are float
+        numeric_fields = ["sessions", "screenPageViews", "userEngagementDuration", 
+                         "eventCount", "addToCarts", "checkouts"]
+        for field in numeric_fields:
+            if field in user_data_copy:
+                user_data_copy[field] = float(user_data_copy[field])
             else:
-                user_data_copy = user_data
+                user_data_copy[field] = 0.0
                 
-            # Check if we have the minimum required data
-            required_fields = ["sessionSourceMedium", "deviceCategory"]
-            for field in required_fields:
-                if field not in user_data_copy:
-                    response = jsonify({"status": "error", "error": f"Missing required field: {field}"})
-                    return response, 400
-                    
-            # Ensure numeric fields are float
-            numeric_fields = ["sessions", "screenPageViews", "userEngagementDuration", 
-                             "eventCount", "addToCarts", "checkouts"]
-            for field in numeric_fields:
-                if field in user_data_copy:
-                    user_data_copy[field] = float(user_data_copy[field])
-                else:
-                    user_data_copy[field] = 0.0
-                    
-        except Exception as e:
-            logging.error(f"Error parsing website data: {e}")
-            response = jsonify({"status": "error", "error": f"Invalid data format: {str(e)}"})
-            return response, 400
-            
-        # Process website data
-        try:
-            # Pass training_columns directly to get_user_metrics_from_website
-            # This will ensure we get exactly the right number of features
-            X = get_user_metrics_from_website(user_data_copy, training_columns)
-            if X is None:
-                response = jsonify({"status": "error", "error": "Error preparing data for prediction"})
-                return response, 500
-        except Exception as e:
-            logging.error(f"Error in processing: {e}")
-            response = jsonify({"status": "error", "error": f"Processing error: {str(e)}"})
-            return response, 500
-            
-        # Make prediction
-        try:
-            # Get probability
-            purchase_prob = model.predict_proba(X)[0, 1]
-            
-            # Apply optimal threshold
-            purchase_likely = purchase_prob >= OPTIMAL_THRESHOLD
-            
-            # Round probability for cleaner output
-            purchase_prob = round(float(purchase_prob), 4)
-            
-            # Prepare response
-            result = {
-                "status": "success",
-                "user_id": user_id,
-                "purchase_probability": purchase_prob,
-                "purchase_likely": bool(purchase_likely),
-                "threshold_used": OPTIMAL_THRESHOLD,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            # Log prediction
-            logging.info(f"Website prediction for {user_id}: prob={purchase_prob}, likely={purchase_likely}")
-            
-            # Return the dictionary directly for Flask-RESTful to handle
-            return result, 200
-            
-        except Exception as e:
-            logging.error(f"Error in prediction: {e}")
-            response = jsonify({"status": "error", "error": f"Prediction error: {str(e)}"})
-            return response, 500
+    except HTTPException:
+        # Let Flask answer errors raised while reading the body (413 when over MAX_REQUEST_BYTES)
+        raise
+    except Exception as e:
+        logging.error(f"Error parsing website data: {e}")
+        return json_response({"status": "error", "error": f"Invalid data format: {str(e)}"}, 400)
+        
+    # Process website data
+    try:
+        # Pass training_columns directly to get_user_metrics_from_website
+        # This will ensure we get exactly the right number of features, as a float32 array
+        X = get_user_metrics_from_website(user_data_copy, training_columns)
+        if X is None:
+            return json_response({"status": "error", "error": "Error preparing data for prediction"}, 500)
+    except Exception as e:
+        logging.error(f"Error in processing: {e}")
+        return json_response({"status": "error", "error": f"Processing error: {str(e)}"}, 500)
+        
+    # Make prediction
+    try:
+        # Get probability (batched with concurrent requests)
+        purchase_prob = predictor.predict(X)[0]
+        
+        # Apply optimal threshold
+        purchase_likely = purchase_prob >= OPTIMAL_THRESHOLD
+        
+        # Round probability for cleaner output
+        purchase_prob = round(float(purchase_prob), 4)
+        
+        # Prepare response
+        result = {
+            "status": "success",
+            "user_id": user_id,
+            "purchase_probability": purchase_prob,
+            "purchase_likely": bool(purchase_likely),
+            "threshold_used": OPTIMAL_THRESHOLD,
+            "timestamp": iso_now_cached()
+        }
+        
+        # Log prediction
+        logging.info("Website prediction for %s: prob=%s, likely=%s", user_id, purchase_prob, purchase_likely)
+        
+        return json_response(result)
+        
+    except Exception as e:
+        logging.error(f"Error in prediction: {e}")
+        return json_response({"status": "error", "error": f"Prediction error: {str(e)}"}, 500)
 
 # Register API resources
 api.add_resource(HealthCheck, '/health')
-api.add_resource(PredictFromGA4, '/predict/ga4')
-api.add_resource(PredictFromWebsite, '/predict/website')
 
 # Add a basic welcome page
 @app.route('/')
@@ -281,13 +309,17 @@ def index():
     </html>
     """
 
+# Load the model at import time so that `gunicorn --preload` shares it between workers
+# Refuse to start without a model: exit non-zero so gunicorn (preload_app) or the
+# development server fail at startup instead of answering every request with 500
+if not load_model():
+    logging.error("Failed to load model. API not started.")
+    raise SystemExit(1)
+
 if __name__ == "__main__":
-    # Load model before starting the server
-    if load_model():
-        # Run the API server locally for testing
+    if os.environ.get("FLASK_DEV") == "1":
+        # Development server with debugger and reloader
         app.run(host="0.0.0.0", port=5000, debug=True)
     else:
-        logging.error("Failed to load model. API not started.")
-else:
-    # Para cuando se ejecuta a través de passenger_wsgi.py en Hostinger
-    load_model()
+        logging.warning("Servidor de desarrollo de Flask; en producción usar: gunicorn prediction_api:app (ver gunicorn.conf.py)")
+        app.run(host="0.0.0.0", port=5000, threaded=True)
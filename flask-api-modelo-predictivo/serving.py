@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# serving.py - Model scoring for the prediction API (micro-batching and optional ONNX Runtime)
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+# onnxruntime is optional: when installed and an exported model exists, it scores the trees in native code
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# Maximum number of queued rows scored in one predict_proba call
+MAX_BATCH_SIZE = 64
+# How long (seconds) the worker waits for more requests before scoring a batch
+MAX_BATCH_WAIT = 0.005
+
+# (second, ISO timestamp) of the last formatted response time
+_TS_CACHE = (0, "")
+
+def iso_now_cached():
+    """
+    Returns the current UTC time as an ISO 8601 string with second resolution.
+    The string is formatted at most once per second and shared by all requests.
+    """
+    global _TS_CACHE
+    t = int(time.time())
+    cached = _TS_CACHE
+    if cached[0] != t:
+        cached = (t, datetime.fromtimestamp(t, tz=timezone.utc).replace(tzinfo=None).isoformat() + "Z")
+        _TS_CACHE = cached
+    return cached[1]
+
+class OnnxModel:
+    """Wraps an ONNX Runtime session behind the predict_proba interface used by BatchPredictor"""
+    def __init__(self, path):
+        self.session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Input width fixed at export time (None when the exported shape is symbolic)
+        width = model_input.shape[-1] if model_input.shape else None
+        self.n_features_in_ = width if isinstance(width, int) else None
+
+    def predict_proba(self, X):
+        # Outputs are [labels, probabilities] (exported without ZipMap, so probabilities is an array)
+        return self.session.run(None, {self.input_name: np.asarray(X, dtype=np.float32)})[1]
+
+def load_onnx_model(path):
+    """
+    Returns an OnnxModel for path, or None when onnxruntime is not installed,
+    the file does not exist or it cannot be loaded (the sklearn model is used instead).
+    """
+    if ort is None or not os.path.exists(path):
+        return None
+    try:
+        onnx_model = OnnxModel(path)
+        logging.info(f"ONNX model loaded from {path}")
+        return onnx_model
+    except Exception as e:
+        logging.error(f"Error loading ONNX model {path}: {e}")
+        return None
+
+class _PendingPrediction:
+    """A request waiting in the queue for its probabilities"""
+    __slots__ = ("X", "event", "result", "error")
+
+    def __init__(self, X):
+        self.X = X
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class BatchPredictor:
+    """
+    Collects concurrent prediction requests for a short window and scores them
+    with a single predict_proba call, then hands each request its own rows.
+
+    Args:
+        model: Fitted classifier exposing predict_proba
+        max_batch_size: Maximum number of requests scored together
+        max_wait: Seconds to wait for more requests once the first one arrives
+    """
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT):
+        self.model = model
+        # The API builds feature arrays without column names; models fitted on a DataFrame get
+        # their feature names back so sklearn checks the columns instead of warning on every batch
+        self.feature_names = getattr(model, "feature_names_in_", None)
+        self.n_features = getattr(model, "n_features_in_", None)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def predict(self, X):
+        """
+        Returns the positive-class probability for each row of X.
+        Blocks until the batch containing X has been scored.
+        """
+        self._ensure_worker()
+        # Tree models compare features as float32 internally: cast once here, at the boundary,
+        # so the batch is stacked and scored without float64 copies (no-op for float32 input)
+        pending = _PendingPrediction(np.asarray(X, dtype=np.float32))
+        self._queue.put(pending)
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_worker(self):
+        # Started lazily so that forked WSGI workers each get their own thread
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="batch-predictor", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        """Waits for one request, then gathers more until the batch is full or the window closes"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _as_model_input(self, X):
+        """Wraps X in a DataFrame with the model's feature names when the model was fitted with them"""
+        if self.feature_names is not None and X.shape[1] == len(self.feature_names):
+            return pd.DataFrame(X, columns=self.feature_names, copy=False)
+        return X
+
+    def _check_input(self, X, width):
+        """Returns an error for a request whose array cannot be stacked with the batch, else None"""
+        if X.ndim != 2:
+            return ValueError(f"Expected a 2D feature array, got shape {X.shape}")
+        if X.shape[1] != width:
+            return ValueError(f"Expected {width} features, got {X.shape[1]}")
+        return None
+
+    def _score(self, batch):
+        """Scores batch with one predict_proba call and hands each request its rows"""
+        probabilities = self.model.predict_proba(self._as_model_input(np.vstack([p.X for p in batch])))[:, 1]
+        start = 0
+        for pending in batch:
+            end = start + len(pending.X)
+            pending.result = probabilities[start:end]
+            start = end
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                # A malformed request is rejected on its own instead of failing the whole batch
+                width = self.n_features or next((p.X.shape[1] for p in batch if p.X.ndim == 2), None)
+                valid = []
+                for pending in batch:
+                    pending.error = self._check_input(pending.X, width)
+                    if pending.error is None:
+                        valid.append(pending)
+                if valid:
+                    try:
+                        self._score(valid)
+                    except Exception as e:
+                        # Score the requests one by one so only the one(s) that fail get the error
+                        logging.warning(f"Batch prediction error, scoring requests individually: {e}")
+                        for pending in valid:
+                            try:
+                                self._score([pending])
+                            except Exception as request_error:
+                                logging.error(f"Prediction error: {request_error}")
+                                pending.error = request_error
+            except Exception as e:
+                logging.error(f"Batch prediction error: {e}")
+                for pending in batch:
+                    if pending.result is None:
+                        pending.error = e
+            finally:
+                for pending in batch:
+                    pending.event.set()
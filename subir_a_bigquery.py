@@ -4,17 +4,69 @@ Script para cargar datos de Google Analytics a BigQuery
 """
 import os
 import argparse
+import tempfile
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from google.cloud import bigquery
 
-def cargar_a_bigquery(archivo_csv, dataset_id, tabla_id, proyecto_id=None):
+# Extensiones que ya son Parquet y se suben sin convertir
+EXTENSIONES_PARQUET = ('.parquet', '.pq')
+
+# Bytes de CSV que Arrow lee por bloque al convertir a Parquet (el primero se usa para inferir los tipos)
+TAMANO_BLOQUE_CSV = 64 * 1024 * 1024
+
+def _tipo_bigquery(tipo):
+    """Traduce un tipo de Arrow al tipo de columna equivalente en BigQuery"""
+    if pa.types.is_boolean(tipo):
+        return 'BOOLEAN'
+    if pa.types.is_integer(tipo):
+        return 'INTEGER'
+    if pa.types.is_floating(tipo) or pa.types.is_decimal(tipo):
+        return 'FLOAT'
+    if pa.types.is_timestamp(tipo):
+        return 'TIMESTAMP'
+    if pa.types.is_date(tipo):
+        return 'DATE'
+    return 'STRING'
+
+def _esquema_bigquery(esquema):
+    """Construye el esquema de BigQuery a partir del esquema de una tabla de Arrow"""
+    return [bigquery.SchemaField(campo.name, _tipo_bigquery(campo.type)) for campo in esquema]
+
+def _csv_a_parquet(archivo_csv, ruta_parquet):
     """
-    Carga datos desde un archivo CSV a BigQuery
+    Convierte el CSV a Parquet (zstd) leyéndolo por bloques con Arrow: cada bloque se escribe
+    como un grupo de filas, de modo que nunca se tiene el archivo completo en memoria.
+    Devuelve el esquema de Arrow de la tabla escrita, o None si un bloque posterior no encaja
+    con los tipos inferidos del primero (por ejemplo, decimales en una columna que empezó entera).
+    """
+    lector = pacsv.open_csv(archivo_csv, read_options=pacsv.ReadOptions(block_size=TAMANO_BLOQUE_CSV))
+    try:
+        with pq.ParquetWriter(ruta_parquet, lector.schema, compression='zstd') as escritor:
+            for lote in lector:
+                escritor.write_batch(lote)
+    except pa.ArrowInvalid as e:
+        print(f"⚠️ No se pudo convertir el CSV a Parquet ({e}); se cargará como CSV con detección de esquema")
+        return None
+    return lector.schema
+
+def cargar_a_bigquery(archivo_csv, dataset_id, tabla_id, proyecto_id=None, bucket=None):
+    """
+    Carga datos desde un archivo CSV (o Parquet) a BigQuery.
+    El CSV se convierte por bloques a un Parquet temporal con tipos explícitos, de modo que BigQuery
+    no tiene que recorrer el archivo para detectar el esquema y se suben menos bytes.
+    Los archivos Parquet se suben tal cual. Si los tipos del CSV cambian después del primer bloque
+    y la conversión falla, el CSV se sube directamente y BigQuery detecta el esquema.
     
     Args:
         archivo_csv: Ruta del archivo CSV con los datos
         dataset_id: ID del dataset en BigQuery
         tabla_id: ID de la tabla en BigQuery
         proyecto_id: ID del proyecto de Google Cloud (si es None, usa el proyecto por defecto)
+        bucket: Bucket de Cloud Storage opcional; si se indica, el Parquet se sube allí y BigQuery
+                lo carga desde gs:// en paralelo en lugar de recibirlo por la conexión del cliente
+                (el archivo subido se borra del bucket al terminar la carga)
     """
     # Crear cliente de BigQuery
     cliente = bigquery.Client(project=proyecto_id)
@@ -22,32 +74,81 @@ def cargar_a_bigquery(archivo_csv, dataset_id, tabla_id, proyecto_id=None):
     # Definir referencia al dataset y tabla
     tabla_ref = cliente.dataset(dataset_id).table(tabla_id)
     
-    # Configurar el trabajo de carga
-    configuracion_trabajo = bigquery.LoadJobConfig(
-        source_format=bigquery.SourceFormat.CSV,
-        skip_leading_rows=1,  # Ignora la cabecera
-        autodetect=True,  # Detecta automáticamente el esquema
-    )
-
     print(f"Cargando datos de {archivo_csv} a {dataset_id}.{tabla_id}")
     
-    # Cargar datos a BigQuery
-    with open(archivo_csv, "rb") as archivo:
-        trabajo_carga = cliente.load_table_from_file(
-            archivo, tabla_ref, job_config=configuracion_trabajo
-        )
-    
-    # Esperar a que termine el trabajo de carga
-    trabajo_carga.result()
+    ruta_temporal = None
+    try:
+        # Obtener el Parquet a subir y su esquema (tipado y en columnas)
+        if archivo_csv.lower().endswith(EXTENSIONES_PARQUET):
+            ruta_subida = archivo_csv
+            esquema = pq.read_schema(archivo_csv)
+        else:
+            descriptor, ruta_temporal = tempfile.mkstemp(suffix='.parquet')
+            os.close(descriptor)
+            ruta_subida = ruta_temporal
+            esquema = _csv_a_parquet(archivo_csv, ruta_subida)
+        
+        if esquema is not None:
+            # Configurar el trabajo de carga con el esquema ya conocido
+            configuracion_trabajo = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.PARQUET,
+                schema=_esquema_bigquery(esquema),
+            )
+        else:
+            # La conversión falló: subir el CSV original y dejar que BigQuery detecte el esquema
+            ruta_subida = archivo_csv
+            configuracion_trabajo = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.CSV,
+                skip_leading_rows=1,
+                autodetect=True,
+            )
+        
+        # Cargar datos a BigQuery y esperar a que termine el trabajo de carga
+        if bucket:
+            trabajo_carga = _cargar_desde_bucket(cliente, ruta_subida, archivo_csv, bucket, proyecto_id,
+                                                 tabla_ref, configuracion_trabajo)
+        else:
+            with open(ruta_subida, 'rb') as archivo:
+                trabajo_carga = cliente.load_table_from_file(
+                    archivo, tabla_ref, job_config=configuracion_trabajo
+                )
+            trabajo_carga.result()
+    finally:
+        if ruta_temporal and os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
     
     print(f"Carga completada. Filas cargadas: {trabajo_carga.output_rows}")
 
+def _cargar_desde_bucket(cliente, ruta_subida, archivo_csv, bucket, proyecto_id, tabla_ref, configuracion_trabajo):
+    """
+    Sube el archivo (Parquet, o el CSV si no se pudo convertir) a Cloud Storage, lo carga en BigQuery
+    desde gs:// y lo borra del bucket al terminar (también si la carga falla).
+    Devuelve el trabajo de carga terminado.
+    """
+    # Importación local: google-cloud-storage solo es necesario con --bucket
+    from google.cloud import storage
+    nombre_blob = os.path.splitext(os.path.basename(archivo_csv))[0] + os.path.splitext(ruta_subida)[1]
+    blob = storage.Client(project=proyecto_id).bucket(bucket).blob(nombre_blob)
+    blob.upload_from_filename(ruta_subida, content_type='application/octet-stream')
+    uri = f'gs://{bucket}/{nombre_blob}'
+    print(f"Archivo subido a {uri}")
+    try:
+        trabajo_carga = cliente.load_table_from_uri(
+            uri, tabla_ref, job_config=configuracion_trabajo
+        )
+        trabajo_carga.result()
+        return trabajo_carga
+    finally:
+        blob.delete()
+        print(f"Archivo temporal {uri} eliminado")
+
 def main():
     parser = argparse.ArgumentParser(description='Cargar datos de Google Analytics a BigQuery')
-    parser.add_argument('--archivo', required=True, help='Ruta del archivo CSV con datos')
+    parser.add_argument('--archivo', required=True, help='Ruta del archivo CSV (o Parquet) con datos')
     parser.add_argument('--proyecto', help='ID del proyecto de Google Cloud')
     parser.add_argument('--dataset', required=True, help='ID del dataset en BigQuery')
     parser.add_argument('--tabla', required=True, help='ID de la tabla en BigQuery')
+    parser.add_argument('--bucket', help='Bucket de Cloud Storage donde subir el archivo antes de cargarlo (opcional)')
     
     args = parser.parse_args()
     
@@ -57,7 +158,7 @@ def main():
         return
     
     # Cargar datos a BigQuery
-    cargar_a_bigquery(args.archivo, args.dataset, args.tabla, args.proyecto)
+    cargar_a_bigquery(args.archivo, args.dataset, args.tabla, args.proyecto, args.bucket)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pd = pytest.importorskip("pandas")
+joblib = pytest.importorskip("joblib")
+pytest.importorskip("sklearn")
+pytest.importorskip("pyarrow")
+pytest.importorskip("seaborn")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import entrenar_modelo  # noqa: E402
+from sklearn.multioutput import MultiOutputRegressor  # noqa: E402
+from utils import incremental  # noqa: E402
+
+
+def _escribir_csv(ruta, n_filas=600, semilla=0):
+    """CSV sintético con métricas numéricas, una dimensión categórica y dos objetivos lineales"""
+    rng = np.random.default_rng(semilla)
+    sesiones = rng.integers(1, 50, n_filas)
+    eventos = sesiones * rng.integers(1, 10, n_filas)
+    carritos = rng.integers(0, 5, n_filas)
+    pd.DataFrame({
+        'sessions': sesiones,
+        'eventCount': eventos,
+        'addToCarts': carritos,
+        'deviceCategory': rng.choice(['desktop', 'mobile', 'tablet'], n_filas),
+        'conversions': 0.3 * sesiones + 2.0 * carritos + rng.normal(0, 1, n_filas),
+        'purchaseRevenue': 5.0 * carritos + 0.1 * eventos + rng.normal(0, 2, n_filas),
+    }).to_csv(ruta, index=False)
+
+
+def _entrenar(archivo, salida, objetivos):
+    entrenar_modelo.main([
+        '--archivos', str(archivo), '--objetivos', *objetivos, '--modelo-salida', 'modelo.joblib',
+        '--salida', str(salida), '--incremental', '--batch-size', '200', '--epochs', '2',
+    ])
+    return joblib.load(os.path.join(salida, 'modelo.joblib'))['modelo']
+
+
+def _arboles(modelo):
+    """Número de árboles (n_iter_) de cada estimador de salida del paso final"""
+    final = modelo.steps[-1][1]
+    return [est.n_iter_ for est in getattr(final, 'estimators_', [final])]
+
+
+@pytest.mark.parametrize('objetivos', [['conversions'], ['conversions', 'purchaseRevenue']])
+def test_entrenamiento_incremental_continua_sobre_el_modelo_guardado(tmp_path, objetivos):
+    archivo = tmp_path / 'datos.csv'
+    salida = tmp_path / 'resultados'
+    _escribir_csv(archivo)
+
+    modelo_1 = _entrenar(archivo, salida, objetivos)
+    # La segunda ejecución carga el modelo guardado y debe seguir añadiéndole árboles (sin fallar
+    # por arrays de solo lectura ni reiniciar los estimadores)
+    modelo_2 = _entrenar(archivo, salida, objetivos)
+
+    # Mismo modelo de árboles que el pipeline por lotes: sin escalado y sin MultiOutputRegressor
+    # para un solo objetivo
+    assert 'scaler' not in modelo_2.named_steps
+    assert isinstance(modelo_2.steps[-1][1], MultiOutputRegressor) == (len(objetivos) > 1)
+    assert len(_arboles(modelo_2)) == len(objetivos)
+    assert all(a2 > a1 for a1, a2 in zip(_arboles(modelo_1), _arboles(modelo_2)))
+    assert all(a <= incremental.MAX_ARBOLES for a in _arboles(modelo_2))
+
+
+def test_entrenamiento_incremental_no_pasa_del_maximo_de_arboles(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, 'MAX_ARBOLES', incremental.ARBOLES_INICIALES + 10)
+    archivo = tmp_path / 'datos.csv'
+    salida = tmp_path / 'resultados'
+    _escribir_csv(archivo)
+
+    modelo_1 = _entrenar(archivo, salida, ['conversions'])
+    assert _arboles(modelo_1) == [incremental.MAX_ARBOLES]
+    # Con el máximo alcanzado, la siguiente ejecución reentrena desde cero en lugar de seguir creciendo
+    modelo_2 = _entrenar(archivo, salida, ['conversions'])
+    assert _arboles(modelo_2)[0] <= incremental.MAX_ARBOLES
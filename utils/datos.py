@@ -1,30 +1,168 @@
+import hashlib
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-def cargar_multiples_archivos(archivos_csv):
-    """Carga y combina datos de múltiples archivos CSV"""
-    print(f"Cargando datos desde {len(archivos_csv)} archivos...")
-    dataframes = []
-    for archivo in archivos_csv:
-        print(f"Procesando: {archivo}")
-        try:
-            df = pd.read_csv(archivo)
+logger = logging.getLogger(__name__)
+
+# Tamaño aproximado (en bytes) de cada bloque al ajustar el StandardScaler
+TAMANO_BLOQUE_ESCALADO = 64 * 1024 * 1024
+
+# Mayor magnitud entera que float32 representa sin pérdida (mantisa de 24 bits)
+MAX_ENTERO_FLOAT32 = 2 ** 24
+
+# Extensiones de archivos binarios columnares que se leen sin pasar por el parser CSV
+EXTENSIONES_PARQUET = ('.parquet', '.pq')
+EXTENSIONES_FEATHER = ('.feather', '.arrow')
+
+def columnas_enteras_grandes(df, columnas=None):
+    """
+    Devuelve las columnas enteras de df (de entre columnas, si se indica) con algún valor
+    fuera de ±MAX_ENTERO_FLOAT32. En float32 perderían precisión: por ejemplo, fechas
+    YYYYMMDD de días consecutivos acabarían con el mismo valor.
+    """
+    enteras = df.select_dtypes(include=[np.integer]).columns
+    if columnas is not None:
+        seleccion = set(columnas)
+        enteras = [col for col in enteras if col in seleccion]
+    maximos = df[list(enteras)].abs().max()
+    return [col for col in enteras if pd.notna(maximos[col]) and maximos[col] > MAX_ENTERO_FLOAT32]
+
+def leer_columnas_csv(archivo):
+    """Devuelve la lista de columnas de un archivo de datos leyendo solo la cabecera (o el esquema)"""
+    extension = os.path.splitext(archivo)[1].lower()
+    if extension in EXTENSIONES_PARQUET:
+        return pq.read_schema(archivo).names
+    if extension in EXTENSIONES_FEATHER:
+        return pa.ipc.open_file(archivo).schema.names
+    return pd.read_csv(archivo, nrows=0).columns.tolist()
+
+def _eliminar_duplicados(df):
+    """
+    Elimina filas duplicadas (conserva la primera) usando un hash vectorizado por fila.
+    Solo las filas cuyo hash se repite se comparan de forma exacta, así que el resultado
+    es idéntico al de drop_duplicates() sin recorrer todo el DataFrame.
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    candidatas = hashes.duplicated(keep=False).to_numpy()
+    if not candidatas.any():
+        return df
+    duplicadas = np.zeros(len(df), dtype=bool)
+    duplicadas[candidatas] = df[candidatas].duplicated().to_numpy()
+    return df[~duplicadas]
+
+def _ruta_cache_parquet(archivo, directorio_cache):
+    """Ruta del Parquet en caché para un CSV, identificado por ruta, fecha de modificación y tamaño"""
+    info = os.stat(archivo)
+    clave = f"{os.path.abspath(archivo)}:{info.st_mtime_ns}:{info.st_size}"
+    return os.path.join(directorio_cache, hashlib.blake2b(clave.encode('utf-8'), digest_size=16).hexdigest() + '.parquet')
+
+def _guardar_cache_parquet(df, ruta_cache):
+    """Guarda el DataFrame en Parquet (Snappy); un fallo al escribir la caché no interrumpe la carga"""
+    ruta_temporal = ruta_cache + '.tmp'
+    try:
+        df.to_parquet(ruta_temporal, engine='pyarrow', compression='snappy', index=False)
+        os.replace(ruta_temporal, ruta_cache)
+    except Exception as e:
+        logger.warning(f"  - ⚠️ No se pudo guardar la caché Parquet: {str(e)}")
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+
+def _leer_csv(archivo, tamano_bloque=None, directorio_cache=None):
+    """
+    Lee un CSV y devuelve (DataFrame, None) o (None, excepción) si falla.
+    Con tamano_bloque se lee por bloques y se eliminan los duplicados de cada bloque
+    antes de combinarlos, de modo que nunca se retiene el archivo completo sin deduplicar.
+    Con directorio_cache, la primera lectura se guarda en Parquet y las siguientes
+    se leen (con memory map) desde ahí mientras el CSV no cambie.
+    Los archivos Parquet y Feather se leen directamente, sin bloques ni caché.
+    """
+    try:
+        extension = os.path.splitext(archivo)[1].lower()
+        if extension in EXTENSIONES_PARQUET:
+            return pd.read_parquet(archivo, engine='pyarrow', memory_map=True), None
+        if extension in EXTENSIONES_FEATHER:
+            return pd.read_feather(archivo), None
+        ruta_cache = None
+        if directorio_cache:
+            ruta_cache = _ruta_cache_parquet(archivo, directorio_cache)
+            if os.path.exists(ruta_cache):
+                return pd.read_parquet(ruta_cache, engine='pyarrow', memory_map=True), None
+        if tamano_bloque is None:
+            # Parser CSV multihilo de Arrow (el motor 'pyarrow' no admite lectura por bloques)
+            df = pd.read_csv(archivo, engine='pyarrow')
+        else:
+            bloques = [_eliminar_duplicados(bloque) for bloque in pd.read_csv(archivo, chunksize=tamano_bloque)]
+            df = pd.concat(bloques, ignore_index=True)
+        if ruta_cache:
+            _guardar_cache_parquet(df, ruta_cache)
+        return df, None
+    except Exception as e:
+        return None, e
+
+def _cargar_dataset_parquet(archivos):
+    """
+    Lee varios Parquet como un único dataset de PyArrow: lectura multihilo a una sola tabla,
+    sin DataFrames intermedios que concatenar. Devuelve None si los esquemas no son compatibles.
+    """
+    try:
+        esquema = pa.unify_schemas([pq.read_schema(archivo) for archivo in archivos])
+        tabla = ds.dataset(archivos, format='parquet', schema=esquema).to_table(use_threads=True)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron leer los archivos como un único dataset Parquet: {str(e)}")
+        return None
+    for archivo in archivos:
+        logger.info(f"Procesando: {archivo}")
+        logger.info(f"  - Cargadas {pq.read_metadata(archivo).num_rows} filas y {len(esquema)} columnas")
+    return tabla.to_pandas(split_blocks=True, self_destruct=True)
+
+def cargar_multiples_archivos(archivos_csv, max_workers=None, tamano_bloque=None, directorio_cache=None):
+    """
+    Carga y combina datos de múltiples archivos CSV (o Parquet/Feather, según la extensión).
+    Los archivos se leen en paralelo con un pool de hilos (el parser de pandas libera el GIL)
+    y se combinan en el orden recibido. Si se indica tamano_bloque, cada archivo se lee por
+    bloques de ese número de filas deduplicando sobre la marcha para limitar la memoria.
+    Si se indica directorio_cache, cada CSV se guarda en Parquet la primera vez y se reutiliza
+    en las siguientes ejecuciones mientras no cambie.
+    Si todos los archivos son Parquet, se leen de una vez como un dataset de PyArrow.
+    """
+    logger.info(f"Cargando datos desde {len(archivos_csv)} archivos...")
+    datos_combinados = None
+    if len(archivos_csv) > 1 and all(os.path.splitext(a)[1].lower() in EXTENSIONES_PARQUET for a in archivos_csv):
+        datos_combinados = _cargar_dataset_parquet(archivos_csv)
+
+    if datos_combinados is None:
+        if directorio_cache and not os.path.exists(directorio_cache):
+            os.makedirs(directorio_cache)
+        if max_workers is None:
+            max_workers = min(len(archivos_csv), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            lecturas = list(executor.map(lambda archivo: _leer_csv(archivo, tamano_bloque, directorio_cache), archivos_csv))
+
+        dataframes = []
+        for archivo, (df, error) in zip(archivos_csv, lecturas):
+            logger.info(f"Procesando: {archivo}")
+            if error is not None:
+                logger.error(f"  - Error al cargar {archivo}: {str(error)}")
+                continue
             dataframes.append(df)
-            print(f"  - Cargadas {len(df)} filas y {len(df.columns)} columnas")
-        except Exception as e:
-            print(f"  - Error al cargar {archivo}: {str(e)}")
-    if not dataframes:
-        raise ValueError("No se pudo cargar ningún archivo de datos")
-    datos_combinados = pd.concat(dataframes, ignore_index=True)
+            logger.info(f"  - Cargadas {len(df)} filas y {len(df.columns)} columnas")
+        if not dataframes:
+            raise ValueError("No se pudo cargar ningún archivo de datos")
+        datos_combinados = pd.concat(dataframes, ignore_index=True)
     filas_originales = len(datos_combinados)
-    datos_combinados = datos_combinados.drop_duplicates()
+    datos_combinados = _eliminar_duplicados(datos_combinados)
     filas_unicas = len(datos_combinados)
-    print(f"Se eliminaron {filas_originales - filas_unicas} filas duplicadas")
-    print(f"Conjunto final: {filas_unicas} filas y {len(datos_combinados.columns)} columnas")
+    logger.info(f"Se eliminaron {filas_originales - filas_unicas} filas duplicadas")
+    logger.info(f"Conjunto final: {filas_unicas} filas y {len(datos_combinados.columns)} columnas")
     return datos_combinados
 
 def preprocesar_datos(datos, columnas_objetivo, columnas_excluir=None, usar_fechas=True, directorio_salida='resultados'):
@@ -37,69 +175,105 @@ def preprocesar_datos(datos, columnas_objetivo, columnas_excluir=None, usar_fech
         columnas_excluir: Lista de columnas a excluir del procesamiento (opcional)
         usar_fechas: Boolean que indica si se deben procesar las columnas de fecha (por defecto True)
         directorio_salida: Ruta donde se guardarán las matrices de correlación (por defecto 'resultados')
+
+    El DataFrame devuelto como datos_originales es el mismo objeto recibido en datos,
+    por lo que no debe modificarse mientras se usen los resultados.
     """
-    print("Preprocesando datos...")
-    df = datos.copy()
-    datos_originales = df.copy()
+    logger.info("Preprocesando datos...")
+    # No se duplican los datos: las columnas se sustituyen (nunca se modifican in situ),
+    # así que basta una copia superficial y datos_originales es el propio DataFrame recibido
+    datos_originales = datos
+    df = datos.copy(deep=False)
     if columnas_excluir is None:
         columnas_excluir = []
     columnas_procesadas = []
 
     # Procesar fechas si se solicita
     if 'date' in df.columns and usar_fechas:
-        print("Convirtiendo la columna 'date' a formato datetime...")
+        logger.info("Convirtiendo la columna 'date' a formato datetime...")
         df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        print("Extrayendo características de fechas...")
-        df['año'] = df['date'].dt.year
-        df['mes'] = df['date'].dt.month
-        df['dia_mes'] = df['date'].dt.day
-        df['dia_semana'] = df['date'].dt.dayofweek
-        df['dia_año'] = df['date'].dt.dayofyear
-        df['trimestre'] = df['date'].dt.quarter
-        df['es_fin_semana'] = df['date'].dt.dayofweek.isin([5, 6]).astype(int)
-        df['sin_mes'] = np.sin(2 * np.pi * df['mes'] / 12)
-        df['cos_mes'] = np.cos(2 * np.pi * df['mes'] / 12)
-        df['sin_dia_mes'] = np.sin(2 * np.pi * df['dia_mes'] / 31)
-        df['cos_dia_mes'] = np.cos(2 * np.pi * df['dia_mes'] / 31)
-        df['sin_dia_semana'] = np.sin(2 * np.pi * df['dia_semana'] / 7)
-        df['cos_dia_semana'] = np.cos(2 * np.pi * df['dia_semana'] / 7)
+        logger.info("Extrayendo características de fechas...")
+        # Se calculan todas las características sobre arrays y se añaden con un único concat
+        fechas = df['date'].dt
+        mes = fechas.month.to_numpy(dtype=float)
+        dia_mes = fechas.day.to_numpy(dtype=float)
+        dia_semana = fechas.dayofweek.to_numpy(dtype=float)
+        angulo_mes = (2 * np.pi / 12) * mes
+        angulo_dia_mes = (2 * np.pi / 31) * dia_mes
+        angulo_dia_semana = (2 * np.pi / 7) * dia_semana
+        caracteristicas_fecha = {
+            'año': fechas.year,
+            'mes': fechas.month,
+            'dia_mes': fechas.day,
+            'dia_semana': fechas.dayofweek,
+            'dia_año': fechas.dayofyear,
+            'trimestre': fechas.quarter,
+            'es_fin_semana': (dia_semana >= 5).astype(int),
+            'sin_mes': np.sin(angulo_mes),
+            'cos_mes': np.cos(angulo_mes),
+            'sin_dia_mes': np.sin(angulo_dia_mes),
+            'cos_dia_mes': np.cos(angulo_dia_mes),
+            'sin_dia_semana': np.sin(angulo_dia_semana),
+            'cos_dia_semana': np.cos(angulo_dia_semana),
+        }
+        df = pd.concat([
+            df.drop(columns=[col for col in caracteristicas_fecha if col in df.columns]),
+            pd.DataFrame(caracteristicas_fecha, index=df.index)
+        ], axis=1)
         columnas_excluir.append('date')
-        columnas_procesadas.extend(['año', 'mes', 'dia_mes', 'dia_semana', 'dia_año', 'trimestre',
-                                    'es_fin_semana', 'sin_mes', 'cos_mes', 'sin_dia_mes',
-                                    'cos_dia_mes', 'sin_dia_semana', 'cos_dia_semana'])
+        columnas_procesadas.extend(caracteristicas_fecha.keys())
 
     # Convertir columnas categóricas a numéricas
-    print("Procesando variables categóricas...")
+    logger.info("Procesando variables categóricas...")
     columnas_categoricas = df.select_dtypes(include=['object', 'category']).columns
     if len(columnas_categoricas) > 0:
+        # factorize(sort=True) produce los mismos códigos que astype('category').cat.codes
+        # sin crear la columna categórica intermedia; se asignan todas de una vez
+        codigos = {}
         for col in columnas_categoricas:
-            print(f"  - Codificando columna categórica: {col}")
-            df[col] = df[col].astype('category').cat.codes  # Convertir a códigos numéricos
+            logger.info(f"  - Codificando columna categórica: {col}")
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                codigos[col] = df[col].cat.codes
+            else:
+                codigos[col] = pd.factorize(df[col], sort=True)[0].astype(np.int32)
+        df[list(codigos)] = pd.DataFrame(codigos, index=df.index)
 
     # Eliminar columnas no necesarias
-    print("Eliminando columnas no necesarias...")
-    columnas_a_eliminar = [col for col in columnas_excluir if col in df.columns and col not in columnas_objetivo]
+    logger.info("Eliminando columnas no necesarias...")
+    objetivos = set(columnas_objetivo)
+    columnas_a_eliminar = [col for col in columnas_excluir if col in df.columns and col not in objetivos]
     if columnas_a_eliminar:
         df = df.drop(columns=columnas_a_eliminar)
 
+    # Reducir la precisión de las características (no de los objetivos) para que
+    # el resto del pipeline recorra la mitad de bytes
+    columnas_float = [col for col in df.select_dtypes(include=['float64']).columns if col not in objetivos]
+    if columnas_float:
+        df[columnas_float] = df[columnas_float].astype(np.float32)
+    columnas_int = [col for col in df.select_dtypes(include=['int64']).columns if col not in objetivos]
+    if columnas_int:
+        df[columnas_int] = df[columnas_int].apply(pd.to_numeric, downcast='integer')
+
     # Generar matriz de correlación para cada columna objetivo
-    print("\nGenerando matriz de correlación...")
+    logger.info("\nGenerando matriz de correlación...")
     if not os.path.exists(directorio_salida):
         os.makedirs(directorio_salida)
 
+    # La matriz completa se calcula una sola vez y se reutiliza para cada objetivo
+    matriz_completa = df.corr(numeric_only=True)
     for columna_objetivo in columnas_objetivo:
         if columna_objetivo not in df.columns:
-            print(f"⚠️ La columna objetivo '{columna_objetivo}' no existe en los datos. Saltando...")
+            logger.warning(f"⚠️ La columna objetivo '{columna_objetivo}' no existe en los datos. Saltando...")
             continue
 
         # Calcular correlaciones y filtrar valores relevantes
-        correlaciones = df.corr()[[columna_objetivo]].sort_values(by=columna_objetivo, ascending=False)
+        correlaciones = matriz_completa[[columna_objetivo]].sort_values(by=columna_objetivo, ascending=False)
         correlaciones_filtradas = correlaciones[
             (correlaciones[columna_objetivo] > 0.5) | (correlaciones[columna_objetivo] < -0.5)
         ]
 
         if correlaciones_filtradas.empty:
-            print(f"⚠️ No se encontraron correlaciones significativas para '{columna_objetivo}'.")
+            logger.warning(f"⚠️ No se encontraron correlaciones significativas para '{columna_objetivo}'.")
             continue
 
         matriz_correlacion_path = os.path.join(directorio_salida, f'matriz_correlacion_{columna_objetivo}.png')
@@ -111,26 +285,33 @@ def preprocesar_datos(datos, columnas_objetivo, columnas_excluir=None, usar_fech
         plt.tight_layout()
         plt.savefig(matriz_correlacion_path)
         plt.close()
-        print(f"Matriz de correlación filtrada para '{columna_objetivo}' guardada en: {matriz_correlacion_path}")
+        logger.info(f"Matriz de correlación filtrada para '{columna_objetivo}' guardada en: {matriz_correlacion_path}")
 
     # Antes de escalar, verificar y convertir tipos de datos
-    print("\nVerificando tipos de datos...")
+    logger.info("\nVerificando tipos de datos...")
     for columna in columnas_objetivo:
         if pd.api.types.is_datetime64_any_dtype(df[columna]):
-            print(f"⚠️ Convirtiendo columna datetime '{columna}' a numérica (timestamp)")
+            logger.warning(f"⚠️ Convirtiendo columna datetime '{columna}' a numérica (timestamp)")
             df[columna] = df[columna].astype(np.int64) // 10**9  # Convertir a timestamp
         elif not pd.api.types.is_numeric_dtype(df[columna]):
-            print(f"⚠️ La columna '{columna}' no es numérica. Intentando convertir...")
+            logger.warning(f"⚠️ La columna '{columna}' no es numérica. Intentando convertir...")
             try:
                 df[columna] = pd.to_numeric(df[columna])
             except Exception as e:
                 raise ValueError(f"No se pudo convertir la columna '{columna}' a numérica: {str(e)}")
 
     # Escalar las características
-    print("Escalando características...")
-    scaler = StandardScaler()
-    X = scaler.fit_transform(df.drop(columns=columnas_objetivo))
+    logger.info("Escalando características...")
+    # Se materializa una única matriz float32 (float64 si hay enteros que no caben sin pérdida en
+    # float32); el scaler se ajusta por bloques y la transforma in situ
+    caracteristicas = df.drop(columns=columnas_objetivo)
+    X = caracteristicas.to_numpy(dtype=np.float64 if columnas_enteras_grandes(caracteristicas) else np.float32)
+    scaler = StandardScaler(copy=False)
+    n_bloques = max(1, X.nbytes // TAMANO_BLOQUE_ESCALADO)
+    for bloque in np.array_split(X, n_bloques, axis=0):
+        scaler.partial_fit(bloque)
+    X = scaler.transform(X)
     y = df[columnas_objetivo]
-    print(f"Características procesadas: {df.drop(columns=columnas_objetivo).columns.tolist()}")
-    print(f"Dimensiones de X: {X.shape}, Dimensiones de y: {y.shape}")
+    logger.info(f"Características procesadas: {caracteristicas.columns.tolist()}")
+    logger.info(f"Dimensiones de X: {X.shape}, Dimensiones de y: {y.shape}")
     return X, y, columnas_procesadas, datos_originales
\ No newline at end of file
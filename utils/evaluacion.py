@@ -2,7 +2,7 @@ import os
 import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.model_selection import cross_val_score, KFold
+from sklearn.model_selection import cross_validate, KFold
 import numpy as np
 import pandas as pd
 
@@ -18,8 +18,14 @@ def evaluar_modelo(modelo, X, y, X_val=None, y_val=None, cv=5):
     print("\nUsando KFold para validación cruzada...")
     try:
         kf = KFold(n_splits=cv, shuffle=True, random_state=42)
-        cv_scores = cross_val_score(modelo, X, y, cv=kf, scoring='r2', n_jobs=-1)
-        mse_scores = -cross_val_score(modelo, X, y, cv=kf, scoring='neg_mean_squared_error', n_jobs=-1)
+        # Un solo ajuste por fold calcula ambas métricas
+        cv_resultados = cross_validate(
+            modelo, X, y, cv=kf,
+            scoring={'r2': 'r2', 'mse': 'neg_mean_squared_error'},
+            n_jobs=-1
+        )
+        cv_scores = cv_resultados['test_r2']
+        mse_scores = -cv_resultados['test_mse']
         rmse_scores = np.sqrt(mse_scores)
         print(f"R² promedio (CV): {cv_scores.mean():.4f} ± {cv_scores.std():.4f}")
         print(f"RMSE promedio (CV): {rmse_scores.mean():.4f} ± {rmse_scores.std():.4f}")
@@ -121,12 +127,20 @@ def generar_informe(modelo, X_val, y_val, directorio_salida='resultados'):
         else:
             y_pred_cols = [f"pred_{col}" for col in y_val_cols]
 
-        # Convertir a DataFrame para correlación
-        df_real_pred = pd.DataFrame(
-            np.column_stack([np.array(y_val), np.array(y_pred)]),
-            columns=y_val_cols + y_pred_cols
+        # Correlación de Pearson calculada directamente sobre el array combinado;
+        # el DataFrame solo se construye para etiquetar el heatmap
+        valores_reales = np.asarray(y_val, dtype=float)
+        valores_predichos = np.asarray(y_pred, dtype=float)
+        real_pred = np.concatenate([
+            valores_reales.reshape(len(valores_reales), -1),
+            valores_predichos.reshape(len(valores_predichos), -1)
+        ], axis=1)
+        columnas_real_pred = y_val_cols + y_pred_cols
+        corr_matrix = pd.DataFrame(
+            np.corrcoef(real_pred, rowvar=False).reshape(len(columnas_real_pred), len(columnas_real_pred)),
+            index=columnas_real_pred,
+            columns=columnas_real_pred
         )
-        corr_matrix = df_real_pred.corr(method='pearson')
 
         # Graficar heatmap de la matriz de correlación (sin guardar CSV)
         heatmap_path = os.path.join(directorio_salida, 'matriz_correlacion.png')
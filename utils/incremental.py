@@ -1,45 +1,159 @@
 import matplotlib
 matplotlib.use('Agg')  # Configurar backend no interactivo
+import copy
 import os
+from concurrent.futures import ThreadPoolExecutor
+import joblib
 import numpy as np
 import pandas as pd
 import json
-from sklearn.base import clone
 from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor
 from sklearn.multioutput import MultiOutputRegressor
 from sklearn.pipeline import Pipeline
-from sklearn.metrics import r2_score
 from utils.evaluacion import generar_informe, evaluar_modelo
 import logging
 
-def imputar_valores_faltantes(X):
-    """Imputa valores faltantes en X"""
-    if isinstance(X, np.ndarray):
-        imputer = SimpleImputer(strategy='mean')
-        return imputer.fit_transform(X)
-    return X
+# Árboles del ajuste inicial y árboles que se añaden con cada mini-lote (warm start)
+ARBOLES_INICIALES = 50
+ARBOLES_POR_LOTE = 5
+# Máximo de árboles por objetivo (los mismos que el pipeline por lotes): limita la memoria
+# y el tiempo de predicción del modelo aunque se siga entrenando en ejecuciones posteriores
+MAX_ARBOLES = 300
+# Cada cuántos lotes se evalúa el modelo (además de al final de cada época)
+EVALUAR_CADA = 10
+# Archivo (en el directorio de salida) con la huella del modelo y del conjunto de evaluación
+# de los últimos informes generados
+ARCHIVO_HUELLA_INFORME = '.informe_huella'
 
-def crear_pipeline_incremental():
-    """Crea un pipeline optimizado para entrenamiento incremental"""
-    base_model = GradientBoostingRegressor(
-        n_estimators=300,
+def crear_pipeline_incremental(multiples_objetivos=True):
+    """
+    Crea un pipeline optimizado para entrenamiento incremental.
+    Con un solo objetivo se usa el estimador directamente, sin MultiOutputRegressor.
+    """
+    # Boosting por histogramas (características discretizadas en bins enteros), como el pipeline por lotes.
+    # warm_start: cada nuevo ajuste añade árboles sobre los ya entrenados en lugar de empezar de cero;
+    # sin early_stopping, que en cada lote apartaría una parte para validar y cortaría el crecimiento
+    base_model = HistGradientBoostingRegressor(
+        max_iter=ARBOLES_INICIALES,
         learning_rate=0.05,
         max_depth=4,
-        min_samples_split=5,
         min_samples_leaf=3,
-        subsample=0.8,
+        l2_regularization=1.0,
+        warm_start=True,
+        early_stopping=False,
         random_state=42
     )
     
+    # Sin StandardScaler: los árboles son invariantes a la escala de las características
     return Pipeline([
         ('imputer', SimpleImputer(strategy='median')),
-        ('scaler', StandardScaler()),
-        ('model', MultiOutputRegressor(base_model, n_jobs=-1))
+        ('model', MultiOutputRegressor(base_model, n_jobs=-1) if multiples_objetivos else base_model)
     ])
 
-def entrenar_por_lotes(modelo, X, y, batch_size, n_epochs, directorio_salida):
+def _estimadores_de_salida(modelo):
+    """Devuelve los estimadores ajustados del paso final (uno por objetivo) o None"""
+    final = modelo.steps[-1][1]
+    if hasattr(final, 'estimators_'):
+        return final.estimators_
+    if hasattr(final, 'n_iter_'):
+        return [final]
+    return None
+
+def _admite_warm_start(modelo):
+    """
+    Indica si el modelo es un pipeline cuyo estimador final, sin ajustar o ya ajustado,
+    puede seguir añadiendo árboles (warm start)
+    """
+    if not isinstance(modelo, Pipeline):
+        return False
+    estimadores = _estimadores_de_salida(modelo)
+    if estimadores is None:
+        final = modelo.steps[-1][1]
+        base = final.estimator if isinstance(final, MultiOutputRegressor) else final
+        return isinstance(base, HistGradientBoostingRegressor)
+    return all(isinstance(est, HistGradientBoostingRegressor) for est in estimadores)
+
+def _arboles_maximos(modelo):
+    """Indica si todos los estimadores de salida del modelo ajustado tienen ya MAX_ARBOLES árboles"""
+    return all(est.n_iter_ >= MAX_ARBOLES for est in _estimadores_de_salida(modelo))
+
+def _preprocesar(modelo, X):
+    """Aplica los pasos de preprocesamiento ya ajustados del pipeline (todos menos el modelo)"""
+    return modelo[:-1].transform(X) if len(modelo.steps) > 1 else X
+
+def _ampliar_modelo(modelo, X_batch, y_batch):
+    """
+    Continúa el boosting del modelo con un mini-lote: cada estimador de salida recibe hasta
+    ARBOLES_POR_LOTE árboles nuevos (warm start) ajustados sobre el lote, conservando los
+    anteriores, sin pasar de MAX_ARBOLES. Los preprocesadores ajustados se reutilizan tal cual.
+    Devuelve False si ningún estimador ha crecido (todos tienen ya MAX_ARBOLES árboles).
+    """
+    # MultiOutputRegressor.fit clonaría los estimadores; se ajusta cada uno directamente
+    X_transformado = _preprocesar(modelo, X_batch)
+    y_batch = y_batch.reshape(len(y_batch), -1)
+    ampliado = False
+    for i, estimador in enumerate(_estimadores_de_salida(modelo)):
+        arboles = min(estimador.n_iter_ + ARBOLES_POR_LOTE, MAX_ARBOLES)
+        if arboles <= estimador.n_iter_:
+            continue
+        estimador.set_params(warm_start=True, early_stopping=False, max_iter=arboles)
+        estimador.fit(X_transformado, y_batch[:, i])
+        ampliado = True
+    return ampliado
+
+def _r2_medio(y_eval_2d, ss_tot, prediccion):
+    """
+    R² medio entre objetivos (equivale a r2_score con multioutput='uniform_average') a partir de la
+    suma de cuadrados total ya calculada, sin repetir la validación de r2_score en cada evaluación.
+    Un objetivo constante puntúa 1 si se predice sin error y 0 en otro caso, como en sklearn.
+    """
+    ss_res = ((y_eval_2d - prediccion.reshape(len(y_eval_2d), -1)) ** 2).sum(axis=0)
+    varia = ss_tot > 0
+    r2 = np.where(varia, 1 - ss_res / np.where(varia, ss_tot, 1), np.where(ss_res == 0, 1.0, 0.0))
+    return float(r2.mean())
+
+def _leer_huella(ruta):
+    """Devuelve la huella guardada en ruta o None si no existe o no se puede leer"""
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _lotes_con_prefetch(cargar_lote, n_lotes, executor):
+    """
+    Genera (k, X_batch, y_batch) para k = 0..n_lotes-1. Mientras se entrena con el lote k,
+    el lote k+1 ya se está cargando en el hilo del executor (doble buffer).
+    """
+    futuro = executor.submit(cargar_lote, 0) if n_lotes else None
+    for k in range(n_lotes):
+        X_batch, y_batch = futuro.result()
+        if k + 1 < n_lotes:
+            futuro = executor.submit(cargar_lote, k + 1)
+        yield k, X_batch, y_batch
+
+def codificar_lotes(X, y, batch_size, directorio, rng):
+    """
+    Guarda X e y como archivos .npy de un lote cada uno (X_00000.npy, y_00000.npy, ...) en directorio.
+    Las filas se barajan una vez al escribirlas; en cada época basta con barajar el orden de los
+    archivos, que se leen de forma secuencial con memory-mapping.
+    Devuelve la lista de pares (ruta_X, ruta_y) en orden de lote.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    permutacion = rng.permutation(X.shape[0])
+    lotes = []
+    for k, start_idx in enumerate(range(0, X.shape[0], batch_size)):
+        filas = permutacion[start_idx:start_idx + batch_size]
+        ruta_X = os.path.join(directorio, f'X_{k:05d}.npy')
+        ruta_y = os.path.join(directorio, f'y_{k:05d}.npy')
+        np.save(ruta_X, X[filas])
+        np.save(ruta_y, y[filas])
+        lotes.append((ruta_X, ruta_y))
+    return lotes
+
+def entrenar_por_lotes(modelo, X, y, batch_size, n_epochs, directorio_salida, callback_progreso=None,
+                       directorio_lotes=None):
     """Entrena el modelo de forma incremental usando mini-lotes
     
     Args:
@@ -49,6 +163,9 @@ def entrenar_por_lotes(modelo, X, y, batch_size, n_epochs, directorio_salida):
         batch_size: Tamaño de los lotes para entrenamiento
         n_epochs: Número de épocas de entrenamiento
         directorio_salida: Directorio donde se guardarán los resultados
+        callback_progreso: Función opcional que recibe la fracción completada (0-1) al final de cada época
+        directorio_lotes: Directorio opcional donde guardar los lotes como .npy; si se indica, las épocas
+                          leen cada lote del disco con memory-mapping y se baraja el orden de los lotes
     """
     # Configurar logging en lugar de print para mensajes
     logging.basicConfig(level=logging.INFO, format='%(message)s')
@@ -56,78 +173,174 @@ def entrenar_por_lotes(modelo, X, y, batch_size, n_epochs, directorio_salida):
     
     logger.info(f"\nEntrenamiento incremental con {n_epochs} épocas y lotes de {batch_size}")
     
-    # Convertir entradas a numpy arrays
+    # Convertir entradas a numpy arrays contiguos: float32 para X (el tipo que usan los árboles),
+    # de modo que cada
+    # X[batch_indices] copia la mitad de bytes y sklearn no vuelve a convertir.
+    # Si X trae columnas float64 (enteros grandes que float32 no representa sin pérdida) se mantiene float64
     X = X.values if isinstance(X, pd.DataFrame) else X
     y = y.values if isinstance(y, pd.DataFrame) else y
+    X = np.ascontiguousarray(X, dtype=np.result_type(np.asarray(X).dtype, np.float32))
+    y = np.asarray(y)
+    y = np.ascontiguousarray(y, dtype=y.dtype if np.issubdtype(y.dtype, np.integer) else np.float32)
     
-    # Crear modelo si no existe
+    # Crear modelo si no existe o si el cargado no puede seguir añadiendo árboles (modelos antiguos),
+    # predice otro número de objetivos o ya tiene MAX_ARBOLES árboles: en ese caso se reentrena
+    # desde cero con los datos de esta ejecución (ventana móvil) en lugar de crecer sin límite
+    n_objetivos = y.shape[1] if y.ndim > 1 else 1
+    admite_warm_start = modelo is not None and _admite_warm_start(modelo)
+    estimadores = _estimadores_de_salida(modelo) if admite_warm_start else None
+    if modelo is not None and not admite_warm_start:
+        logger.info("⚠️ El modelo existente no admite entrenamiento incremental (warm start); se crea uno nuevo")
+        modelo = None
+    elif estimadores is not None and len(estimadores) != n_objetivos:
+        logger.info(f"⚠️ El modelo existente predice {len(estimadores)} objetivos y los datos tienen "
+                    f"{n_objetivos}; se crea uno nuevo")
+        modelo = None
+    elif estimadores is not None and _arboles_maximos(modelo):
+        logger.info(f"⚠️ El modelo existente ya tiene {MAX_ARBOLES} árboles por objetivo; "
+                    "se reentrena desde cero con los datos de esta ejecución")
+        modelo = None
     if modelo is None:
-        modelo = crear_pipeline_incremental()
+        modelo = crear_pipeline_incremental(multiples_objetivos=n_objetivos > 1)
+    # Un estimador de un solo objetivo trabaja con y en 1D
+    if not isinstance(modelo.steps[-1][1], MultiOutputRegressor) and y.ndim > 1 and y.shape[1] == 1:
+        y = y.ravel()
         
     logger.info(f"Dimensiones de entrada - X: {X.shape}, y: {y.shape}")
     
-    # Ajuste inicial del modelo
-    initial_size = min(batch_size * 10, X.shape[0])
-    indices_iniciales = np.random.choice(X.shape[0], initial_size, replace=False)
-    modelo.fit(X[indices_iniciales], y[indices_iniciales])
+    # Generador PCG64 con semilla fija: más rápido que el Mersenne Twister global y reproducible
+    rng = np.random.default_rng(42)
+    
+    # Ajuste inicial solo para un modelo nuevo (ARBOLES_INICIALES árboles sobre una muestra).
+    # Un modelo ya entrenado conserva su imputer, sus bins y sus árboles, y los lotes de esta
+    # ejecución le añaden árboles nuevos
+    if _estimadores_de_salida(modelo) is not None:
+        logger.info("Continuando el entrenamiento del modelo existente")
+    else:
+        initial_size = min(batch_size * 10, X.shape[0])
+        indices_iniciales = rng.choice(X.shape[0], initial_size, replace=False, shuffle=False)
+        modelo.fit(X[indices_iniciales], y[indices_iniciales])
     
     # Variables para el entrenamiento
     n_samples = X.shape[0]
-    indices = np.arange(n_samples)
     mejor_score = -np.inf
     mejor_modelo = None
     n_eval = min(1000, X.shape[0])  # Tamaño del conjunto de evaluación
-    indices_eval = np.random.choice(X.shape[0], n_eval, replace=False)
+    indices_eval = rng.choice(X.shape[0], n_eval, replace=False, shuffle=False)
     X_eval = X[indices_eval]
     y_eval = y[indices_eval]
+    # Suma de cuadrados total de cada objetivo en eval: fija durante todo el entrenamiento
+    y_eval_2d = y_eval.reshape(n_eval, -1).astype(np.float64)
+    ss_tot = ((y_eval_2d - y_eval_2d.mean(axis=0)) ** 2).sum(axis=0)
+    
+    # Con warm start los preprocesadores quedan fijos tras el ajuste inicial: X_eval se transforma una sola vez
+    # y en cada lote solo se ejecuta el predict del estimador final
+    X_eval_t = _preprocesar(modelo, X_eval)
+    estimador_final = modelo.steps[-1][1]
+    
+    # Lotes en disco (se escriben una vez y se reutilizan en todas las épocas)
+    lotes = None
+    if directorio_lotes:
+        lotes = codificar_lotes(X, y, batch_size, directorio_lotes, rng)
+        logger.info(f"{len(lotes)} lotes guardados en {directorio_lotes}")
+    
+    n_lotes = (n_samples + batch_size - 1) // batch_size
+    
+    def cargar_lote(k):
+        # Se ejecuta en el hilo de prefetch: la copia del lote (indexado o lectura del .npy)
+        # se solapa con el ajuste del lote anterior, que libera el GIL en su mayor parte
+        if lotes is not None:
+            ruta_X, ruta_y = lotes[orden_lotes[k]]
+            return np.array(np.load(ruta_X, mmap_mode='r')), np.array(np.load(ruta_y, mmap_mode='r'))
+        batch_indices = indices[k * batch_size:(k + 1) * batch_size]
+        return X[batch_indices], y[batch_indices]
     
     # Entrenamiento por épocas
+    executor = ThreadPoolExecutor(max_workers=1)
+    # sin_evaluar: el modelo ha cambiado desde la última evaluación; completo: todos los estimadores tienen MAX_ARBOLES
+    sin_evaluar = True
+    completo = False
     for epoch in range(n_epochs):
         logger.info(f"\nÉpoca {epoch + 1}/{n_epochs}")
-        np.random.shuffle(indices)
+        # Orden de la época como permutación nueva (no se modifica el array mientras se precarga)
+        if lotes is not None:
+            orden_lotes = rng.permutation(len(lotes))
+        else:
+            indices = rng.permutation(n_samples)
         
-        for start_idx in range(0, n_samples, batch_size):
+        for k, X_batch, y_batch in _lotes_con_prefetch(cargar_lote, n_lotes, executor):
+            start_idx = k * batch_size
             end_idx = min(start_idx + batch_size, n_samples)
-            batch_indices = indices[start_idx:end_idx]
-            
-            X_batch = X[batch_indices]
-            y_batch = y[batch_indices]
             
             try:
-                # Transformar y entrenar
-                modelo.fit(X_batch, y_batch)
+                # Añadir árboles al modelo con el lote (hasta MAX_ARBOLES por objetivo)
+                if _ampliar_modelo(modelo, X_batch, y_batch):
+                    sin_evaluar = True
+                else:
+                    completo = True
+                
+                # Evaluar solo cada EVALUAR_CADA lotes, en el último lote de la época
+                # y al llegar a MAX_ARBOLES (si el modelo ha cambiado desde la última evaluación)
+                numero_lote = start_idx // batch_size + 1
+                if not completo and numero_lote % EVALUAR_CADA != 0 and end_idx < n_samples:
+                    continue
+                if not sin_evaluar:
+                    # Ya tenía MAX_ARBOLES árboles y se evaluó en el lote anterior
+                    break
                 
                 # Evaluar en conjunto de evaluación fijo
-                score = r2_score(y_eval, modelo.predict(X_eval))
+                score = _r2_medio(y_eval_2d, ss_tot, estimador_final.predict(X_eval_t))
+                sin_evaluar = False
                 
                 if score > mejor_score:
                     mejor_score = score
-                    mejor_modelo = clone(modelo)
-                    mejor_modelo.fit(X_batch, y_batch)
+                    # Copia del modelo ya entrenado que ha dado este score (sin reentrenar)
+                    mejor_modelo = copy.deepcopy(modelo)
                 
-                if (start_idx + batch_size) % (batch_size * 10) == 0:
+                if numero_lote % EVALUAR_CADA == 0:
                     logger.info(f"Procesado hasta muestra {end_idx}/{n_samples} - R² en eval: {score:.4f}")
             except Exception as e:
                 logger.info(f"\n❌ Error en batch {start_idx}-{end_idx}: {str(e)}")
                 continue
+            if completo:
+                break
+
+        if callback_progreso is not None:
+            callback_progreso((epoch + 1) / n_epochs)
+        if completo:
+            logger.info(f"El modelo tiene {MAX_ARBOLES} árboles por objetivo; se termina el entrenamiento")
+            break
+    executor.shutdown()
     
     logger.info(f"\nMejor R² conseguido en evaluación: {mejor_score:.4f}")
     
-    # Evaluar y generar informes usando el mismo conjunto de evaluación
+    # Evaluar y generar informes usando el mismo conjunto de evaluación. Solo se omiten si ya
+    # existen y corresponden exactamente a este modelo y a este conjunto de evaluación
+    # (por ejemplo, al repetir una ejecución que no ha cambiado el modelo guardado)
+    modelo_final = mejor_modelo if mejor_modelo is not None else modelo
+    resultados_json = os.path.join(directorio_salida, 'resultados_modelo_incremental.json')
+    informe_html = os.path.join(directorio_salida, 'informe_modelo.html')
+    ruta_huella = os.path.join(directorio_salida, ARCHIVO_HUELLA_INFORME)
+    huella = joblib.hash((modelo_final, X_eval, y_eval))
+    if (_leer_huella(ruta_huella) == huella
+            and os.path.exists(resultados_json) and os.path.exists(informe_html)):
+        logger.info("\nLos informes ya corresponden a este modelo; no se regeneran")
+        return modelo_final
     try:
         logger.info("\nGenerando informes de evaluación...")
-        modelo_final = mejor_modelo if mejor_modelo is not None else modelo
         
         # Evaluar modelo y guardar resultados
         resultados = evaluar_modelo(modelo_final, X_eval, y_eval)
-        resultados_json = os.path.join(directorio_salida, 'resultados_modelo_incremental.json')
         with open(resultados_json, 'w') as f:
             json.dump(resultados, f, indent=2)
         
         # Generar informe visual
         generar_informe(modelo_final, X_eval, y_eval, directorio_salida=directorio_salida)
         
+        # Huella guardada solo con los informes completos
+        with open(ruta_huella, 'w', encoding='utf-8') as f:
+            f.write(huella)
     except Exception as e:
         logger.error(f"Error al generar informes: {str(e)}")
     
-    return mejor_modelo if mejor_modelo is not None else modelo
\ No newline at end of file
+    return modelo_final
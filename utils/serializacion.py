@@ -0,0 +1,35 @@
+import json
+import os
+
+# orjson es opcional: más rápido que json y serializa tipos de NumPy directamente
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def a_json(datos, indentar=False):
+    """
+    Serializa datos a texto JSON usando orjson si está instalado y json en caso contrario.
+    Los valores que no son JSON nativo (por ejemplo, escalares de NumPy) se convierten con float().
+    """
+    if orjson is not None:
+        opciones = orjson.OPT_SERIALIZE_NUMPY
+        if indentar:
+            opciones |= orjson.OPT_INDENT_2
+        return orjson.dumps(datos, default=float, option=opciones).decode('utf-8')
+    return json.dumps(datos, default=float, ensure_ascii=False, indent=2 if indentar else None)
+
+def guardar_json(datos, ruta, indentar=True, omitir_si_igual=False):
+    """
+    Guarda datos como JSON (UTF-8) en la ruta indicada.
+    Con omitir_si_igual=True no se reescribe un fichero que ya tiene el mismo contenido
+    (se conserva su fecha de modificación). Devuelve True si se ha escrito el fichero.
+    """
+    contenido = a_json(datos, indentar=indentar).encode('utf-8')
+    if omitir_si_igual and os.path.exists(ruta):
+        with open(ruta, 'rb') as f:
+            if f.read() == contenido:
+                return False
+    with open(ruta, 'wb') as f:
+        f.write(contenido)
+    return True
@@ -1,6 +1,50 @@
+import numpy as np
 import pandas as pd
 import os
-import json
+
+from utils.datos import columnas_enteras_grandes
+from utils.serializacion import guardar_json
+
+# Proporción máxima de nulos admitida en una feature de ratio
+MAX_NULOS_RATIO = 0.8
+# Máximo de columnas numéricas que se combinan en ratios (se generan hasta k·(k-1) features)
+MAX_COLUMNAS_RATIO = 30
+
+def _calcular_ratios(df, columnas_numericas):
+    """
+    Calcula los ratios col1/col2 entre columnas numéricas distintas como un DataFrame.
+    Un denominador 0 da NaN; se omiten los denominadores siempre 0, los nombres que ya
+    existen en df y los ratios con más de MAX_NULOS_RATIO de nulos.
+    Con más de MAX_COLUMNAS_RATIO columnas solo se combinan las de mayor varianza.
+    """
+    A = df[columnas_numericas].to_numpy(dtype=np.float64, na_value=np.nan)
+    if len(columnas_numericas) > MAX_COLUMNAS_RATIO:
+        # Acota la memoria a O(MAX_COLUMNAS_RATIO²) columnas en tablas anchas
+        with np.errstate(all='ignore'):
+            varianzas = np.nan_to_num(np.nanvar(A, axis=0), nan=-1.0)
+        seleccion = np.sort(np.argsort(-varianzas, kind='stable')[:MAX_COLUMNAS_RATIO])
+        A = A[:, seleccion]
+        columnas_numericas = [columnas_numericas[i] for i in seleccion]
+    no_cero = A != 0
+    # Denominadores con algún valor distinto de 0, calculado para todas las columnas en una pasada
+    denominador_valido = no_cero.any(axis=0)
+    existentes = set(df.columns)
+    ratios = {}
+    for j, col2 in enumerate(columnas_numericas):
+        if not denominador_valido[j]:
+            continue
+        # Todos los numeradores entre el denominador j en una sola pasada
+        bloque = np.full(A.shape, np.nan)
+        np.divide(A, A[:, j:j + 1], out=bloque, where=no_cero[:, j:j + 1])
+        fraccion_nulos = np.isnan(bloque).mean(axis=0)
+        for i, col1 in enumerate(columnas_numericas):
+            nombre_feature = f"{col1}_per_{col2}"
+            # Evitar crear features redundantes si ya existen
+            if i != j and nombre_feature not in existentes and fraccion_nulos[i] <= MAX_NULOS_RATIO:
+                ratios[(i, j)] = (nombre_feature, bloque[:, i].copy())
+    # Mismo orden de columnas que el recorrido numerador/denominador original
+    claves = sorted(ratios)
+    return pd.DataFrame({ratios[k][0]: ratios[k][1] for k in claves}, index=df.index)
 
 def seleccionar_columnas_entrenamiento(df, columnas_objetivo, args):
     """
@@ -11,29 +55,31 @@ def seleccionar_columnas_entrenamiento(df, columnas_objetivo, args):
     """
     # Detectar columnas numéricas y categóricas dinámicamente
     columnas_objetivo = columnas_objetivo or []
-    columnas_numericas = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col]) and col not in columnas_objetivo]
-    columnas_categoricas = [col for col in df.columns if (df[col].dtype == 'object' or df[col].dtype.name == 'category') and col not in columnas_objetivo]
-
-    # Ingeniería de características flexible: ratios entre columnas numéricas (evitar divisiones triviales)
-    nuevas_features = []
-    for i, col1 in enumerate(columnas_numericas):
-        for j, col2 in enumerate(columnas_numericas):
-            if i != j and not df[col2].eq(0).all():
-                nombre_feature = f"{col1}_per_{col2}"
-                # Evitar crear features redundantes si ya existen
-                if nombre_feature not in df.columns:
-                    df[nombre_feature] = df[col1] / df[col2].replace(0, pd.NA)
-                    nuevas_features.append(nombre_feature)
-    # Eliminar features con demasiados nulos (más del 80%)
-    for feature in nuevas_features:
-        if df[feature].isnull().mean() > 0.8:
-            df.drop(columns=[feature], inplace=True)
-    # Actualizar columnas numéricas con las nuevas features válidas
-    columnas_numericas = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col]) and col not in columnas_objetivo]
-
-    X_num = df[columnas_numericas]
+    objetivos = set(columnas_objetivo)
+    # select_dtypes lee los tipos ya cacheados del DataFrame (bool cuenta como numérico, igual que
+    # is_numeric_dtype) y conserva el orden original de las columnas
+    columnas_numericas = [col for col in df.select_dtypes(include=[np.number, 'bool']).columns if col not in objetivos]
+    columnas_categoricas = [col for col in df.select_dtypes(include=['object', 'category']).columns if col not in objetivos]
+
+    # Ingeniería de características flexible: ratios entre columnas numéricas (evitar divisiones triviales).
+    # Se calculan por denominador con una sola división de NumPy sobre todos los numeradores a la vez
+    X_ratios = _calcular_ratios(df, columnas_numericas)
+
     X_cat = pd.get_dummies(df[columnas_categoricas], prefix=columnas_categoricas, dummy_na=False)
-    X = pd.concat([X_num, X_cat], axis=1)
+    # Una sola matriz float32 en lugar de dos pd.concat (alineación por índice y copias intermedias);
+    # se devuelve como DataFrame para conservar los nombres de columna
+    enteras_grandes = columnas_enteras_grandes(df, columnas_numericas)
+    bloques = [df[[col for col in columnas_numericas if col not in enteras_grandes]], X_ratios, X_cat]
+    X = pd.DataFrame(
+        np.concatenate([b.to_numpy(dtype=np.float32, na_value=np.nan) for b in bloques], axis=1),
+        columns=[col for b in bloques for col in b.columns],
+        index=df.index
+    )
+    if enteras_grandes:
+        # Los enteros que float32 no representa sin pérdida (p. ej. fechas YYYYMMDD) van en float64,
+        # exacto hasta 2^53, y se recupera el orden original de las columnas
+        X = pd.concat([X, df[enteras_grandes].astype(np.float64)], axis=1)
+        X = X[columnas_numericas + [col for b in bloques[1:] for col in b.columns]]
 
     # Si no se especifica objetivo, usar 'ecommercePurchases' > 0 como binario si existe
     if not columnas_objetivo:
@@ -54,7 +100,7 @@ def seleccionar_columnas_entrenamiento(df, columnas_objetivo, args):
         columnas_info = {
             "columnas_objetivo": columnas_objetivo
         }
-        with open(os.path.join(salida_dir, "training_columns.json"), "w", encoding="utf-8") as f:
-            json.dump(columnas_info, f, ensure_ascii=False, indent=2)
+        # Sin reescribir si no ha cambiado, para no invalidar lo que dependa de su fecha de modificación
+        guardar_json(columnas_info, os.path.join(salida_dir, "training_columns.json"), omitir_si_igual=True)
 
     return X, y, columnas_objetivo
\ No newline at end of file
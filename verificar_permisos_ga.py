@@ -6,6 +6,7 @@ import os
 import argparse
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import (
     DateRange,
@@ -19,6 +20,9 @@ from google.analytics.admin import AnalyticsAdminServiceClient
 
 from google.oauth2 import service_account
 
+# Número máximo de cuentas cuyas propiedades se consultan a la vez
+MAX_PETICIONES_PARALELAS = 8
+
 def verificar_credenciales(archivo_clave):
     """
     Verifica que las credenciales sean válidas y muestra información sobre ellas.
@@ -46,8 +50,9 @@ def verificar_credenciales(archivo_clave):
         # Intentar autenticar
         print("\nIntentando autenticar con Google...")
         try:
-            credentials = service_account.Credentials.from_service_account_file(
-                archivo_clave,
+            # Se reutiliza el JSON ya cargado en lugar de volver a leer y analizar el archivo
+            credentials = service_account.Credentials.from_service_account_info(
+                datos_clave,
                 scopes=["https://www.googleapis.com/auth/analytics.readonly"]
             )
             print("✓ Credenciales cargadas correctamente")
@@ -86,6 +91,43 @@ def verificar_acceso_api(credenciales):
         print(f"ERROR al conectar con la API: {str(e)}")
         return None, None
 
+def obtener_cuentas_y_propiedades(analytics_admin_client):
+    """
+    Obtiene las cuentas y propiedades GA4 a las que tiene acceso la cuenta de servicio.
+    - Devuelve una lista de diccionarios por cuenta con 'nombre', 'id', 'ruta', 'propiedades'
+      (lista de diccionarios con 'nombre', 'id' y 'ruta') y 'error' si no se pudieron listar sus propiedades.
+    - Los errores al listar las cuentas se propagan al llamador.
+    """
+    def listar_propiedades(account):
+        account_path = account.name  # Formato: "accounts/XXXX"
+        cuenta = {
+            'nombre': account.display_name,
+            'id': account_path.split('/')[-1],
+            'ruta': account_path,
+            'propiedades': [],
+            'error': None
+        }
+        try:
+            # Listar propiedades para esta cuenta
+            for property in analytics_admin_client.list_properties(parent=account_path):
+                property_path = property.name  # Formato: "properties/XXXX"
+                cuenta['propiedades'].append({
+                    'nombre': property.display_name,
+                    'id': property_path.split('/')[-1],
+                    'ruta': property_path
+                })
+        except Exception as e:
+            cuenta['error'] = str(e)
+        return cuenta
+
+    accounts = list(analytics_admin_client.list_accounts())
+    if not accounts:
+        return []
+    # Las consultas por cuenta son independientes y limitadas por la latencia: se lanzan en paralelo
+    # (map conserva el orden de las cuentas)
+    with ThreadPoolExecutor(max_workers=min(MAX_PETICIONES_PARALELAS, len(accounts))) as executor:
+        return list(executor.map(listar_propiedades, accounts))
+
 def listar_cuentas_disponibles(analytics_admin_client):
     """
     Lista todas las cuentas y propiedades GA4 a las que tiene acceso la cuenta de servicio.
@@ -97,10 +139,7 @@ def listar_cuentas_disponibles(analytics_admin_client):
         
     print("\n=== Verificando acceso a cuentas de GA4 ===")
     try:
-        # Obtener la lista de cuentas (sin necesidad de crear un objeto request)
-        accounts_response = analytics_admin_client.list_accounts()
-        
-        accounts = list(accounts_response)
+        accounts = obtener_cuentas_y_propiedades(analytics_admin_client)
         
         if not accounts:
             print("No se encontraron cuentas. La cuenta de servicio no tiene permisos para ver ninguna cuenta.")
@@ -118,32 +157,20 @@ def listar_cuentas_disponibles(analytics_admin_client):
         found_properties = False
         
         for account in accounts:
-            account_name = account.display_name
-            account_path = account.name  # Formato: "accounts/XXXX"
-            account_id = account_path.split('/')[-1]
-            
-            print(f"\nCUENTA: {account_name} (ID: {account_id})")
+            print(f"\nCUENTA: {account['nombre']} (ID: {account['id']})")
             
-            try:
-                # Listar propiedades para esta cuenta
-                properties_response = analytics_admin_client.list_properties(parent=account_path)
-                properties = list(properties_response)
+            if account['error']:
+                print(f"  Error al obtener propiedades: {account['error']}")
+                continue
                 
-                if not properties:
-                    print("  No se encontraron propiedades GA4")
-                    continue
-                    
-                found_properties = True
-                for property in properties:
-                    property_name = property.display_name
-                    property_path = property.name  # Formato: "properties/XXXX"
-                    property_id = property_path.split('/')[-1]
-                    
-                    print(f"  PROPIEDAD: {property_name} (ID: {property_id}) ★ USAR ESTE ID PARA DESCARGAR DATOS ★")
-                    print(f"             URL completa: {property_path}")
+            if not account['propiedades']:
+                print("  No se encontraron propiedades GA4")
+                continue
                 
-            except Exception as e:
-                print(f"  Error al obtener propiedades: {str(e)}")
+            found_properties = True
+            for property in account['propiedades']:
+                print(f"  PROPIEDAD: {property['nombre']} (ID: {property['id']}) ★ USAR ESTE ID PARA DESCARGAR DATOS ★")
+                print(f"             URL completa: {property['ruta']}")
                 
         if not found_properties:
             print("\n⚠️ ADVERTENCIA: No se encontraron propiedades de GA4.")
@@ -179,7 +206,8 @@ def verificar_propiedad_especifica(analytics_data_client, property_id):
             property=property_id,
             date_ranges=[DateRange(start_date="7daysAgo", end_date="today")],
             metrics=[Metric(name="activeUsers")],
-            dimensions=[Dimension(name="date")]
+            dimensions=[Dimension(name="date")],
+            limit=5  # Solo se muestran 5 filas en la vista previa
         )
         
         response = analytics_data_client.run_report(request)
@@ -196,9 +224,7 @@ def verificar_propiedad_especifica(analytics_data_client, property_id):
         print(f"Métricas: {metric_names}")
         
         # Mostrar hasta 5 filas
-        row_count = min(5, len(response.rows))
-        for i in row_count:
-            row = response.rows[i]
+        for i, row in enumerate(response.rows[:5]):
             dimensions = [dim.value for dim in row.dimension_values]
             metrics = [metric.value for metric in row.metric_values]
             print(f"Fila {i+1}: {dimensions} - {metrics}")